@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+
+# Reusable batch runner for GraphRAG evaluation sweeps.
+# Every (role, question) pair is fanned out over one event loop with bounded
+# concurrency, each finished result is appended to a JSONL checkpoint, and the
+# usual {role}_{mode}_responses.json / {role}_{mode}_sup_info.json files are
+# written from the checkpoint at the end. Re-running with the same checkpoint
+# skips questions that already finished.
+
+
+def result_records(query, role, result):
+    response_data = {
+        "query": query,
+        "response": result.response,
+        "role": role
+    }
+    supplementary_data = {
+        "query": query,
+        "entities": result.context_data["entities"].head().to_dict(),
+        "relationships": result.context_data["relationships"].head().to_dict(),
+        "reports": result.context_data["reports"].head().to_dict(),
+        "sources": result.context_data["sources"].head().to_dict()
+    }
+    if "claims" in result.context_data:
+        supplementary_data["claims"] = result.context_data["claims"].head().to_dict()
+    return response_data, supplementary_data
+
+
+def load_checkpoint(checkpoint_path):
+    done = {}
+    if not os.path.exists(checkpoint_path):
+        return done
+    with open(checkpoint_path, "r") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a run killed mid-write leaves at most one partial line
+                continue
+            done[(record["role"], record["index"])] = record
+    return done
+
+
+def write_outputs(questions_by_role, done, output_dir, mode):
+    os.makedirs(output_dir, exist_ok=True)
+    for role, questions in questions_by_role.items():
+        records = [done[(role, index)] for index in range(len(questions)) if (role, index) in done]
+        with open(f"{output_dir}/{role}_{mode}_responses.json", "w") as f:
+            json.dump([record["response"] for record in records], f, indent=4)
+        with open(f"{output_dir}/{role}_{mode}_sup_info.json", "w") as f:
+            json.dump([record["sup_info"] for record in records], f, indent=4)
+        missing = len(questions) - len(records)
+        print(f"Results written to {output_dir}/{role}_{mode}_*.json" + (f" ({missing} questions missing, re-run to resume)" if missing else ""))
+
+
+async def run_batch(search, questions_by_role, system_prompts, output_dir, mode="local_aligned", max_concurrency=4, checkpoint_path=None, results_store=None):
+    """
+    search is an async callable (query, system_prompt) -> graphrag SearchResult,
+    the written files are also ingested into results_store (a results_store.ResultsStore) when given
+    """
+    checkpoint_path = checkpoint_path or f"{output_dir}/{mode}_checkpoint.jsonl"
+    os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+    done = load_checkpoint(checkpoint_path)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    write_lock = asyncio.Lock()
+
+    # a checkpointed answer only counts if the question file still has the same question at that position
+    done = {key: record for key, record in done.items()
+            if key[1] < len(questions_by_role.get(key[0], [])) and questions_by_role[key[0]][key[1]] == record["query"]}
+    pending = [(role, index, query) for role, questions in questions_by_role.items()
+               for index, query in enumerate(questions) if (role, index) not in done]
+    print(f"{len(done)} questions already answered, {len(pending)} to run")
+
+    with open(checkpoint_path, "a") as checkpoint:
+
+        async def run_one(role, index, query):
+            async with semaphore:
+                result = await search(query, system_prompts[role])
+            response_data, supplementary_data = result_records(query, role, result)
+            record = {"role": role, "index": index, "query": query, "response": response_data, "sup_info": supplementary_data}
+            async with write_lock:
+                checkpoint.write(json.dumps(record, default=str) + "\n")
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+                done[(role, index)] = json.loads(json.dumps(record, default=str))
+            print(f"Role: {role}")
+            print(f"Query: {query}")
+            print(result.response)
+
+        results = await asyncio.gather(*[run_one(role, index, query) for role, index, query in pending], return_exceptions=True)
+
+    for (role, index, query), outcome in zip(pending, results):
+        if isinstance(outcome, Exception):
+            print(f"Failed: {role} / {query}: {outcome!r}")
+
+    write_outputs(questions_by_role, done, output_dir, mode)
+    if results_store is not None:
+        print(f"{results_store.ingest_dir(output_dir)} runs ingested into {results_store.path}")
+    return done
@@ -0,0 +1,162 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from graphrag.query.structured_search.base import SearchResult
+from graphrag.query.structured_search.global_search.search import GlobalSearch
+
+# Global search with a persistent map-step cache and adaptive map concurrency.
+# At temperature 0 the map answer for a report batch only depends on the model, the map
+# prompt, the llm params, the batch text and the query, so it is cached under a hash of
+# those. Shuffling is switched off while caching so the same reports land in the same
+# batches across runs. The fixed map semaphore is replaced by an AIMD limiter that grows
+# while latency stays near the best observed one and halves on rate limits or slowdowns.
+
+MAP_FAILURE = [{"answer": "", "score": 0}]
+
+
+class AdaptiveLimiter:
+    """
+    async context manager bounding in-flight calls with additive increase / multiplicative decrease
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=16, latency_tolerance=2.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.best_latency = None
+        self.in_flight = 0
+        self.condition = None
+        self.local = contextvars.ContextVar("limiter_start")
+        self.stats = {"increases": 0, "decreases": 0, "rate_limited": 0}
+
+    async def __aenter__(self):
+        # created lazily so the limiter binds to the loop that actually runs the search
+        self.condition = self.condition or asyncio.Condition()
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        self.local.set(time.monotonic())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        latency = time.monotonic() - self.local.get()
+        if exc is not None and self.is_rate_limit(exc):
+            self.stats["rate_limited"] += 1
+            self.decrease()
+        elif exc is None:
+            self.best_latency = latency if self.best_latency is None else min(self.best_latency, latency)
+            if latency > self.latency_tolerance * self.best_latency:
+                self.decrease()
+            else:
+                self.increase()
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+        return False
+
+    @staticmethod
+    def is_rate_limit(exc):
+        status_code = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+        return status_code in (429, 503) or "rate limit" in str(exc).lower()
+
+    def increase(self):
+        # one extra slot per window of successful calls
+        if self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.stats["increases"] += 1
+
+    def decrease(self):
+        if self.limit > self.min_limit:
+            self.limit = max(self.min_limit, self.limit / 2)
+            self.stats["decreases"] += 1
+
+
+class MapResponseCache:
+    """
+    sqlite store of map-step responses keyed by (model, map prompt, llm params, report batch, query)
+    """
+
+    def __init__(self, path="map_cache.sqlite"):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS map_responses (key TEXT PRIMARY KEY, response TEXT, "
+                                    "llm_calls INTEGER, prompt_tokens INTEGER, created REAL)")
+
+    @staticmethod
+    def make_key(model, map_system_prompt, llm_params, context_data, query):
+        payload = json.dumps([model, map_system_prompt, llm_params, context_data, query], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT response, llm_calls, prompt_tokens FROM map_responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return {"response": json.loads(row[0]), "llm_calls": row[1], "prompt_tokens": row[2]}
+
+    def put(self, key, response, llm_calls, prompt_tokens):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO map_responses VALUES (?, ?, ?, ?, ?)",
+                                    (key, json.dumps(response), llm_calls, prompt_tokens, time.time()))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class CachedGlobalSearch(GlobalSearch):
+    """
+    GlobalSearch whose map step is served from a MapResponseCache when possible and throttled by an AdaptiveLimiter,
+    results carry llm_calls_saved / prompt_tokens_saved next to the usual llm_calls / prompt_tokens
+    """
+
+    def __init__(self, *args, map_cache=None, limiter=None, context_builder_params=None, concurrent_coroutines=4, **kwargs):
+        context_builder_params = dict(context_builder_params or {})
+        if map_cache is not None:
+            context_builder_params["shuffle_data"] = False
+        super().__init__(*args, context_builder_params=context_builder_params, concurrent_coroutines=concurrent_coroutines, **kwargs)
+        self.map_cache = map_cache
+        self.semaphore = limiter or AdaptiveLimiter(initial=concurrent_coroutines, max_limit=4 * concurrent_coroutines)
+        self.query_savings = contextvars.ContextVar("query_savings")
+        self.totals = {"map_calls": 0, "cache_hits": 0, "llm_calls_saved": 0, "prompt_tokens_saved": 0}
+
+    async def _map_response_single_batch(self, context_data, query, **llm_kwargs):
+        self.totals["map_calls"] += 1
+        key = None
+        if self.map_cache is not None:
+            key = MapResponseCache.make_key(getattr(self.llm, "model", None), self.map_system_prompt, llm_kwargs, context_data, query)
+            cached = self.map_cache.get(key)
+            if cached is not None:
+                savings = self.query_savings.get(None)
+                for counter in (self.totals, savings or {}):
+                    counter["cache_hits"] = counter.get("cache_hits", 0) + 1
+                    counter["llm_calls_saved"] = counter.get("llm_calls_saved", 0) + cached["llm_calls"]
+                    counter["prompt_tokens_saved"] = counter.get("prompt_tokens_saved", 0) + cached["prompt_tokens"]
+                return SearchResult(response=cached["response"], context_data=context_data, context_text=context_data,
+                                    completion_time=0.0, llm_calls=0, prompt_tokens=0)
+
+        result = await super()._map_response_single_batch(context_data=context_data, query=query, **llm_kwargs)
+        # failed batches come back as MAP_FAILURE and are retried on the next run instead of cached
+        if key is not None and result.response != MAP_FAILURE:
+            self.map_cache.put(key, result.response, result.llm_calls, result.prompt_tokens)
+        return result
+
+    async def asearch(self, query, conversation_history=None, **kwargs):
+        savings = {"cache_hits": 0, "llm_calls_saved": 0, "prompt_tokens_saved": 0}
+        token = self.query_savings.set(savings)
+        try:
+            result = await super().asearch(query, conversation_history=conversation_history, **kwargs)
+        finally:
+            self.query_savings.reset(token)
+        result.cache_hits = savings["cache_hits"]
+        result.llm_calls_saved = savings["llm_calls_saved"]
+        result.prompt_tokens_saved = savings["prompt_tokens_saved"]
+        return result
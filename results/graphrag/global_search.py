@@ -7,7 +7,7 @@ from graphrag.query.indexer_adapters import read_indexer_entities, read_indexer_
 from graphrag.query.llm.oai.chat_openai import ChatOpenAI
 from graphrag.query.llm.oai.typing import OpenaiApiType
 from graphrag.query.structured_search.global_search.community_context import GlobalCommunityContext
-from graphrag.query.structured_search.global_search.search import GlobalSearch
+from cached_global_search import CachedGlobalSearch, MapResponseCache
 
 # 1. Setup LLM
 api_key = os.environ["GRAPHRAG_API_KEY"]
@@ -76,7 +76,10 @@ context_builder_params = { "use_community_summary": False, "shuffle_data": True,
 map_llm_params = { "max_tokens": 1000, "temperature": 0.0, "response_format": {"type": "json_object"}, }
 reduce_llm_params = { "max_tokens": 2000, "temperature": 0.0, }
 
-search_engine = GlobalSearch(
+# map answers are cached per (model, report batch, query), which also turns shuffle_data off
+# so report batches stay deterministic; map concurrency adapts to the endpoint's latency
+map_cache = MapResponseCache(f"{llm_model}_results/map_cache.sqlite")
+search_engine = CachedGlobalSearch(
     llm=llm,
     context_builder=context_builder,
     token_encoder=token_encoder,
@@ -86,7 +89,8 @@ search_engine = GlobalSearch(
     allow_general_knowledge=False,
     json_mode=True,
     context_builder_params=context_builder_params,
-    concurrent_coroutines=10,
+    concurrent_coroutines=4,
+    map_cache=map_cache,
     response_type="multiple-page report", # Free form text e.g. prioritized list, single paragraph, multiple paragraphs, multiple-page report
 )
 
@@ -100,4 +104,6 @@ if __name__ == "__main__":
     result = asyncio.run(main(query))
     print(result.response)
     print(result.context_data["reports"])
-    print(f"LLM calls: {result.llm_calls}. LLM tokens: {result.prompt_tokens}")
\ No newline at end of file
+    print(f"LLM calls: {result.llm_calls}. LLM tokens: {result.prompt_tokens}")
+    print(f"Map cache hits: {result.cache_hits}. LLM calls saved: {result.llm_calls_saved}. LLM tokens saved: {result.prompt_tokens_saved}")
+    print(f"Map concurrency limit: {search_engine.semaphore.limit:.1f} {search_engine.semaphore.stats}")
\ No newline at end of file
@@ -1,24 +1,13 @@
 import os
-import pandas as pd
 import tiktoken
 import asyncio
-from rich import print
-import json
-from graphrag.query.indexer_adapters import (
-    read_indexer_entities,
-    read_indexer_relationships,
-    read_indexer_reports,
-    read_indexer_text_units,
-)
-from graphrag.query.context_builder.entity_extraction import EntityVectorStoreKey
-from graphrag.query.input.loaders.dfs import store_entity_semantic_embeddings
 from graphrag.query.llm.oai.chat_openai import ChatOpenAI
 from graphrag.query.llm.oai.embedding import OpenAIEmbedding
 from graphrag.query.llm.oai.typing import OpenaiApiType
-from graphrag.query.structured_search.local_search.mixed_context import LocalSearchMixedContext
-from graphrag.query.structured_search.local_search.search import LocalSearch
 from graphrag.query.question_gen.local_gen import LocalQuestionGen
-from graphrag.vector_stores.lancedb import LanceDBVectorStore
+from batch_runner import run_batch
+from query_host import LocalQueryHost
+from results_store import ResultsStore
 
 # 1. Setup LLM
 api_key = os.environ["GRAPHRAG_API_KEY"]
@@ -69,72 +58,41 @@ llm = ChatOpenAI(api_key="ollama", model=llm_model, api_type=OpenaiApiType.OpenA
 token_encoder = tiktoken.get_encoding("cl100k_base")
 text_embedder = OpenAIEmbedding(api_key=api_key, api_type=OpenaiApiType.OpenAI, model=embedding_model, max_retries=20)
 
-# 2. Load the Context
-INPUT_DIR = "/Users/praison/graphrag/inputs/artifacts"
-ENTITY_TABLE = "create_final_nodes"
-ENTITY_EMBEDDING_TABLE = "create_final_entities"
-RELATIONSHIP_TABLE = "create_final_relationships"
-COMMUNITY_REPORT_TABLE = "create_final_community_reports"
-TEXT_UNIT_TABLE = "create_final_text_units"
-LANCEDB_URI = "ragtest/output/lancedb"
+# 2. Load the Context once: parquet tables, the LanceDB entity store and the context builder
+# live in one query host, so each question only pays for its own search
+GRAPHRAG_OUTPUT_DIR = os.environ.get("GRAPHRAG_OUTPUT_DIR", "ragtest/output")
+LANCEDB_URI = f"{GRAPHRAG_OUTPUT_DIR}/lancedb"
 COMMUNITY_LEVEL = 2
 
-entity_df = pd.read_parquet("ragtest/output/create_final_nodes.parquet")
-entity_embedding_df = pd.read_parquet("ragtest/output/create_final_entities.parquet")
-entities = read_indexer_entities(entity_df, entity_embedding_df, COMMUNITY_LEVEL)
-
-description_embedding_store = LanceDBVectorStore(collection_name="entity_description_embeddings")
-description_embedding_store.connect(db_uri=LANCEDB_URI)
-store_entity_semantic_embeddings(entities=entities, vectorstore=description_embedding_store)
-
-relationship_df = pd.read_parquet("ragtest/output/create_final_relationships.parquet")
-relationships = read_indexer_relationships(relationship_df)
-
-report_df = pd.read_parquet("ragtest/output/create_final_community_reports.parquet")
-reports = read_indexer_reports(report_df, entity_df, COMMUNITY_LEVEL)
-
-text_unit_df = pd.read_parquet("ragtest/output/create_final_text_units.parquet")
-text_units = read_indexer_text_units(text_unit_df)
-
-context_builder = LocalSearchMixedContext(
-    community_reports=reports,
-    text_units=text_units,
-    entities=entities,
-    relationships=relationships,
-    entity_text_embeddings=description_embedding_store,
-    embedding_vectorstore_key=EntityVectorStoreKey.ID,
-    text_embedder=text_embedder,
-    token_encoder=token_encoder,
-)
-
 # 4. Setup Local Search
 local_context_params = { "text_unit_prop": 0.5, "community_prop": 0.1, "conversation_history_max_turns": 5, "conversation_history_user_turns_only": True, "top_k_mapped_entities": 10, "top_k_relationships": 10, "include_entity_rank": True, "include_relationship_weight": True, "include_community_rank": False, "return_candidate_context": False, "max_tokens": 12_000, }
 llm_params = { "max_tokens": 2_000, "temperature": 0.0, }
-search_engine = LocalSearch(
+query_host = LocalQueryHost(
     llm=llm,
-    context_builder=context_builder,
+    text_embedder=text_embedder,
     token_encoder=token_encoder,
-    llm_params=llm_params,
+    output_dir=GRAPHRAG_OUTPUT_DIR,
+    lancedb_uri=LANCEDB_URI,
+    community_level=COMMUNITY_LEVEL,
     context_builder_params=local_context_params,
+    llm_params=llm_params,
     response_type="multiple paragraphs",
 )
 
 # 5. Run Local Search
 async def run_search(query: str, system_prompt: str):
-    full_query = system_prompt + "\n\n" + query
-    result = await search_engine.asearch(full_query)
+    result = await query_host.search(query, system_prompt)
     return result
 
 # 6. Question Generation
-question_generator = LocalQuestionGen(
-    llm=llm,
-    context_builder=context_builder,
-    token_encoder=token_encoder,
-    llm_params=llm_params,
-    context_builder_params=local_context_params,
-)
-
 async def generate_questions(history):
+    question_generator = LocalQuestionGen(
+        llm=llm,
+        context_builder=query_host.load().context_builder,
+        token_encoder=token_encoder,
+        llm_params=llm_params,
+        context_builder_params=local_context_params,
+    )
     questions = await question_generator.agenerate(question_history=history, context_data=None, question_count=5)
     return questions
 
@@ -145,58 +103,8 @@ def read_questions_from_file(file_path):
     return [q.strip() for q in questions]
 
 if __name__ == "__main__":
-    for role, system_prompt in system_templates.items():
-        questions_file = f"questions_{role}.txt"
-        questions = read_questions_from_file(questions_file)
-        
-        responses = []
-        supplementary_info = []
-
-        for query in questions:
-            result = asyncio.run(run_search(query, system_prompt))
-            
-            # Collect response data
-            response_data = {
-                "query": query,
-                "response": result.response,
-                "role": role  # Add the role field
-            }
-            responses.append(response_data)
-            
-            # Collect supplementary information
-            supplementary_data = {
-                "query": query,
-                "entities": result.context_data["entities"].head().to_dict(),
-                "relationships": result.context_data["relationships"].head().to_dict(),
-                "reports": result.context_data["reports"].head().to_dict(),
-                "sources": result.context_data["sources"].head().to_dict()
-            }
-            if "claims" in result.context_data:
-                supplementary_data["claims"] = result.context_data["claims"].head().to_dict()
-            
-            supplementary_info.append(supplementary_data)
-            
-            # Print for debugging
-            print(f"Role: {role}")
-            print(f"Query: {query}")
-            print(result.response)
-            print(result.context_data["entities"].head())
-            print(result.context_data["relationships"].head())
-            print(result.context_data["reports"].head())
-            print(result.context_data["sources"].head())
-            if "claims" in result.context_data:
-                print(result.context_data["claims"].head())
-                print("\n")
-        
-        # Write responses to JSON file
-        with open(f"{llm_model}_results/{role}_local_aligned_responses.json", "w") as f:
-            json.dump(responses, f, indent=4)
-        print(f'Responses written to mistral_results/{role}_aligned_local_responses.json')
-        
-        # Write supplementary information to JSON file
-        with open(f"{llm_model}_results/{role}_local_aligned_sup_info.json", "w") as f:
-            json.dump(supplementary_info, f, indent=4)
-        print(f'Supplementary information written to mistral_results/{role}_aligned_local_sup_info.json')
+    questions_by_role = {role: read_questions_from_file(f"questions_{role}.txt") for role in system_templates}
+    asyncio.run(run_batch(run_search, questions_by_role, system_templates, f"{llm_model}_results", mode="local_aligned", max_concurrency=4, results_store=ResultsStore("results.sqlite")))
 
 # if __name__ == "__main__":
 #     questions_file = "questions.txt"
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import pandas as pd
+from graphrag.query.indexer_adapters import (
+    read_indexer_entities,
+    read_indexer_relationships,
+    read_indexer_reports,
+    read_indexer_text_units,
+)
+from graphrag.query.context_builder.entity_extraction import EntityVectorStoreKey
+from graphrag.query.input.loaders.dfs import store_entity_semantic_embeddings
+from graphrag.query.structured_search.local_search.mixed_context import LocalSearchMixedContext
+from graphrag.query.structured_search.local_search.search import LocalSearch
+from graphrag.vector_stores.lancedb import LanceDBVectorStore
+
+# Long-lived GraphRAG local query host.
+# The parquet artifacts are read once per process into a single context builder, and the
+# entity description embeddings are only written to LanceDB when the collection was not
+# built from the same artifacts. A fingerprint of the artifact files is stored next to the
+# collection; on a match the existing collection is opened as-is.
+
+ENTITY_TABLE = "create_final_nodes"
+ENTITY_EMBEDDING_TABLE = "create_final_entities"
+RELATIONSHIP_TABLE = "create_final_relationships"
+COMMUNITY_REPORT_TABLE = "create_final_community_reports"
+TEXT_UNIT_TABLE = "create_final_text_units"
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def artifact_fingerprint(output_dir, tables, **settings):
+    """
+    content hash of the parquet artifacts and the settings that decide what gets ingested
+    """
+    digest = hashlib.sha256()
+    for name in sorted(settings):
+        digest.update(f"{name}={settings[name]}\n".encode("utf-8"))
+    for table in tables:
+        digest.update(f"{table}={file_digest(f'{output_dir}/{table}.parquet')}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def collection_rows(vectorstore):
+    collection = getattr(vectorstore, "document_collection", None)
+    if collection is None or vectorstore.collection_name not in vectorstore.db_connection.table_names():
+        return None
+    return collection.count_rows()
+
+
+def ensure_entity_embeddings(entities, lancedb_uri, collection_name, fingerprint):
+    """
+    connects the entity description store and re-ingests it only when its fingerprint or the row count recorded after the last ingestion is off,
+    returns (vectorstore, ingested)
+    """
+    vectorstore = LanceDBVectorStore(collection_name=collection_name)
+    vectorstore.connect(db_uri=lancedb_uri)
+    fingerprint_path = f"{lancedb_uri}/{collection_name}.fingerprint.json"
+
+    stored = None
+    if os.path.exists(fingerprint_path):
+        with open(fingerprint_path, "r") as f:
+            stored = json.load(f)
+    if stored and stored["fingerprint"] == fingerprint and collection_rows(vectorstore) == stored["rows"]:
+        return vectorstore, False
+
+    # drop the old fingerprint first so an interrupted ingestion is never mistaken for a complete one
+    if stored:
+        os.remove(fingerprint_path)
+    store_entity_semantic_embeddings(entities=entities, vectorstore=vectorstore)
+    # entities without a description embedding are not written, so record what the collection actually holds
+    rows = collection_rows(vectorstore)
+    os.makedirs(lancedb_uri, exist_ok=True)
+    with open(fingerprint_path + ".tmp", "w") as f:
+        json.dump({"fingerprint": fingerprint, "rows": rows, "collection": collection_name}, f, indent=4)
+    os.replace(fingerprint_path + ".tmp", fingerprint_path)
+    return vectorstore, True
+
+
+class LocalQueryHost:
+    """
+    loads the index once and answers any number of local search queries against it
+    """
+
+    def __init__(self, llm, text_embedder, token_encoder, output_dir="ragtest/output", lancedb_uri=None,
+                 community_level=2, collection_name="entity_description_embeddings",
+                 context_builder_params=None, llm_params=None, response_type="multiple paragraphs"):
+        self.llm = llm
+        self.text_embedder = text_embedder
+        self.token_encoder = token_encoder
+        self.output_dir = output_dir
+        self.lancedb_uri = lancedb_uri or f"{output_dir}/lancedb"
+        self.community_level = community_level
+        self.collection_name = collection_name
+        self.context_builder_params = context_builder_params or {}
+        self.llm_params = llm_params or {}
+        self.response_type = response_type
+        self.context_builder = None
+        self.search_engine = None
+
+    def load(self):
+        if self.context_builder is not None:
+            return self
+        entity_df = pd.read_parquet(f"{self.output_dir}/{ENTITY_TABLE}.parquet")
+        entity_embedding_df = pd.read_parquet(f"{self.output_dir}/{ENTITY_EMBEDDING_TABLE}.parquet")
+        entities = read_indexer_entities(entity_df, entity_embedding_df, self.community_level)
+
+        fingerprint = artifact_fingerprint(self.output_dir, [ENTITY_TABLE, ENTITY_EMBEDDING_TABLE],
+                                           community_level=self.community_level, collection=self.collection_name)
+        description_embedding_store, ingested = ensure_entity_embeddings(entities, self.lancedb_uri, self.collection_name, fingerprint)
+        print(f"Entity embeddings {'ingested into' if ingested else 'reused from'} {self.lancedb_uri}/{self.collection_name}")
+
+        relationships = read_indexer_relationships(pd.read_parquet(f"{self.output_dir}/{RELATIONSHIP_TABLE}.parquet"))
+        reports = read_indexer_reports(pd.read_parquet(f"{self.output_dir}/{COMMUNITY_REPORT_TABLE}.parquet"), entity_df, self.community_level)
+        text_units = read_indexer_text_units(pd.read_parquet(f"{self.output_dir}/{TEXT_UNIT_TABLE}.parquet"))
+
+        self.context_builder = LocalSearchMixedContext(
+            community_reports=reports,
+            text_units=text_units,
+            entities=entities,
+            relationships=relationships,
+            entity_text_embeddings=description_embedding_store,
+            embedding_vectorstore_key=EntityVectorStoreKey.ID,
+            text_embedder=self.text_embedder,
+            token_encoder=self.token_encoder,
+        )
+        self.search_engine = LocalSearch(
+            llm=self.llm,
+            context_builder=self.context_builder,
+            token_encoder=self.token_encoder,
+            llm_params=self.llm_params,
+            context_builder_params=self.context_builder_params,
+            response_type=self.response_type,
+        )
+        return self
+
+    async def search(self, query, system_prompt=None):
+        self.load()
+        full_query = query if system_prompt is None else system_prompt + "\n\n" + query
+        return await self.search_engine.asearch(full_query)
@@ -0,0 +1,232 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+
+# Single SQLite store for the GraphRAG evaluation results.
+# Every {role}_{mode}_responses.json / {role}_{mode}_sup_info.json pair under a
+# {model}_results directory becomes one row per question in `runs`, keyed by
+# (model, role, mode, query_index) since question files repeat some (blank) questions.
+# Re-ingesting a pair replaces every earlier run of its (model, role, mode). The pandas column-oriented context tables of the
+# sup_info files are unpacked into records in `entities`, `relationships`,
+# `reports`, `sources` (and `claims` when present). The same reports and sources come
+# back for most questions of every model, so each distinct record is stored once and
+# `run_{table}` links it to the runs (and row positions) that retrieved it.
+# Queries select only the requested columns.
+
+RUN_COLUMNS = ["run_id", "model", "role", "mode", "query_index", "query", "response"]
+CONTEXT_TABLES = ["entities", "relationships", "reports", "sources", "claims"]
+KEY_COLUMNS = ["model", "role", "mode", "query"]
+# mistral wrote {role}_{mode}responses.json, so the separator before the kind is optional
+RESULT_FILE = re.compile(r"^(?P<role>[^_]+)_(?P<mode>.+?)_?(?P<kind>responses|sup_info)\.json$")
+
+
+def column_name(name):
+    return re.sub(r"[^a-z0-9]+", "_", str(name).lower()).strip("_")
+
+
+def context_rows(table):
+    """
+    turns a pandas to_dict() table ({column: {row: value}}) into a list of {column: value} rows
+    """
+    rows = {}
+    for column, values in table.items():
+        for row, value in values.items():
+            rows.setdefault(int(row), {})[column_name(column)] = value
+    return [rows[row] for row in sorted(rows)]
+
+
+class ResultsStore:
+    """
+    ingests the *_results directories and answers cross-model queries from one sqlite file
+    """
+
+    def __init__(self, path="results.sqlite"):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        schema = self.connection.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'runs'").fetchone()
+        if schema and "UNIQUE (model, role, mode, query)" in schema[0]:
+            raise ValueError(f"{path} keys runs by query, which drops repeated questions; delete it and re-ingest the *_results directories")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, model TEXT NOT NULL, role TEXT NOT NULL, "
+                "mode TEXT NOT NULL, query_index INTEGER, query TEXT NOT NULL, response TEXT, UNIQUE (model, role, mode, query_index))")
+            for table in CONTEXT_TABLES:
+                self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (record_id INTEGER PRIMARY KEY, digest TEXT NOT NULL UNIQUE)")
+                self.connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS run_{table} (run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE, "
+                    f"row INTEGER NOT NULL, record_id INTEGER NOT NULL REFERENCES {table}(record_id), PRIMARY KEY (run_id, row))")
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS run_{table}_record ON run_{table} (record_id)")
+
+    def close(self):
+        self.connection.close()
+
+    def columns(self, table):
+        return [row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")]
+
+    def ensure_columns(self, table, names):
+        # context tables grow a column the first time a file carries it
+        existing = set(self.columns(table))
+        for name in names:
+            if name not in existing:
+                self.connection.execute(f'ALTER TABLE {table} ADD COLUMN "{name}"')
+                existing.add(name)
+
+    @staticmethod
+    def encode(value):
+        return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+    def record_id(self, table, record):
+        """
+        returns the id of a distinct context record, inserting it on first sight
+        """
+        digest = hashlib.sha256(json.dumps(record, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        row = self.connection.execute(f"SELECT record_id FROM {table} WHERE digest = ?", (digest,)).fetchone()
+        if row is not None:
+            return row[0]
+        self.ensure_columns(table, sorted(record))
+        names = sorted(record)
+        quoted = "".join(f', "{name}"' for name in names)
+        placeholders = ", ".join(["?"] * (len(names) + 1))
+        return self.connection.execute(f"INSERT INTO {table} (digest{quoted}) VALUES ({placeholders})",
+                                       [digest] + [self.encode(record[name]) for name in names]).lastrowid
+
+    @staticmethod
+    def match_sup_info(sup_infos, index, query, used):
+        """
+        returns the sup_info record of the question at index: the one at the same position when it agrees
+        on the query (global records carry none), else the first unused record with that query
+        """
+        if index < len(sup_infos) and sup_infos[index].get("query", query) == query:
+            used.add(index)
+            return sup_infos[index]
+        for position, sup_info in enumerate(sup_infos):
+            if position not in used and sup_info.get("query") == query:
+                used.add(position)
+                return sup_info
+        return {}
+
+    def ingest_records(self, model, role, mode, responses, sup_infos=()):
+        """
+        writes one results file pair, replacing every earlier run of the same (model, role, mode),
+        returns the number of runs written
+        """
+        sup_infos, used = list(sup_infos), set()
+        n_written, n_blank = 0, 0
+        with self.connection:
+            self.connection.execute("DELETE FROM runs WHERE model = ? AND role = ? AND mode = ?", (model, role, mode))
+            for index, response in enumerate(responses):
+                query = response["query"]
+                n_blank += not query.strip()
+                sup_info = self.match_sup_info(sup_infos, index, query, used)
+                run_id = self.connection.execute(
+                    "INSERT INTO runs (model, role, mode, query_index, query, response) VALUES (?, ?, ?, ?, ?, ?)",
+                    (model, role, mode, index, query, response.get("response"))).lastrowid
+                for table in CONTEXT_TABLES:
+                    rows = context_rows(sup_info.get(table) or {})
+                    self.connection.executemany(
+                        f"INSERT INTO run_{table} (run_id, row, record_id) VALUES (?, ?, ?)",
+                        [(run_id, position, self.record_id(table, record)) for position, record in enumerate(rows)])
+                n_written += 1
+        if n_blank:
+            print(f"{model}/{role}/{mode}: {n_blank} of {n_written} questions are blank")
+        return n_written
+
+    def ingest_dir(self, results_dir, model=None):
+        """
+        ingests every responses / sup_info pair of a {model}_results directory
+        """
+        model = model or re.sub(r"_results$", "", os.path.basename(os.path.normpath(results_dir)))
+        pairs = {}
+        for path in sorted(glob.glob(os.path.join(results_dir, "*.json"))):
+            match = RESULT_FILE.match(os.path.basename(path))
+            if match:
+                pairs.setdefault((match["role"], match["mode"]), {})[match["kind"]] = path
+        n_runs = 0
+        for (role, mode), paths in sorted(pairs.items()):
+            if "responses" not in paths:
+                continue
+            with open(paths["responses"], "r") as f:
+                responses = json.load(f)
+            sup_infos = []
+            if "sup_info" in paths:
+                with open(paths["sup_info"], "r") as f:
+                    sup_infos = json.load(f)
+            n_runs += self.ingest_records(model, role, mode, responses, sup_infos)
+        return n_runs
+
+    def check_columns(self, table, columns):
+        available = self.columns(table)
+        unknown = [column for column in columns if column not in available]
+        if unknown:
+            raise ValueError(f"unknown {table} columns {unknown}, available: {available}")
+
+    @staticmethod
+    def where(filters):
+        clauses, params = [], []
+        for name, value in filters.items():
+            if name not in KEY_COLUMNS:
+                raise ValueError(f"can only filter on {KEY_COLUMNS}, got {name!r}")
+            if value is None:
+                continue
+            values = [value] if isinstance(value, str) else list(value)
+            clauses.append(f"runs.{name} IN ({', '.join(['?'] * len(values))})")
+            params.extend(values)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def select(self, table="runs", columns=("model", "role", "mode", "query", "response"), **filters):
+        """
+        returns the requested columns of a table as dicts, context tables can also ask for run columns and row,
+        filters match model / role / mode / query against a value or a list of values
+        """
+        columns = list(columns)
+        if table == "runs":
+            self.check_columns("runs", columns)
+            selected = ", ".join(f"runs.{column}" for column in columns)
+            source = "runs"
+        elif table in CONTEXT_TABLES:
+            own = [column for column in columns if column not in RUN_COLUMNS + ["row"]]
+            self.check_columns(table, own)
+            selected = ", ".join(f'{table}."{column}"' if column in own else f"run_{table}.row" if column == "row" else f"runs.{column}" for column in columns)
+            source = f"run_{table} JOIN runs ON runs.run_id = run_{table}.run_id JOIN {table} ON {table}.record_id = run_{table}.record_id"
+        else:
+            raise ValueError(f"unknown table {table!r}, available: {['runs'] + CONTEXT_TABLES}")
+        where, params = self.where(filters)
+        order = "runs.run_id" if table == "runs" else f"runs.run_id, run_{table}.row"
+        cursor = self.connection.execute(f"SELECT {selected} FROM {source}{where} ORDER BY {order}", params)
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def compare(self, column="response", models=None, **filters):
+        """
+        lines up one runs column across models: {(role, mode, query): {model: value}},
+        blank questions are left out since they cannot be told apart
+        """
+        comparison = {}
+        for row in self.select("runs", ["model", "role", "mode", "query", column], model=models, **filters):
+            if not row["query"].strip():
+                continue
+            comparison.setdefault((row["role"], row["mode"], row["query"]), {})[row["model"]] = row[column]
+        return comparison
+
+    def summary(self):
+        cursor = self.connection.execute("SELECT model, mode, COUNT(*) FROM runs GROUP BY model, mode ORDER BY model, mode")
+        return [{"model": model, "mode": mode, "runs": count} for model, mode, count in cursor]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ingest GraphRAG evaluation results into one sqlite store")
+    parser.add_argument("results_dirs", nargs="*", help="defaults to every *_results directory next to this script")
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.sqlite"))
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    results_dirs = args.results_dirs or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*_results")))
+    for results_dir in results_dirs:
+        print(f"{results_dir}: {store.ingest_dir(results_dir)} runs")
+    for row in store.summary():
+        print(row)
+    store.close()
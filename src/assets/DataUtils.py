@@ -1,4 +1,11 @@
+import os
 import re
+import glob
+from decouple import config
+
+ASSETS_DIR = config('MTSS_ASSETS_DIR',default=os.path.dirname(os.path.abspath(__file__)))
+COURSE_FILE = config('MTSS_COURSE_FILE',default=os.path.join(ASSETS_DIR,'Final_txt_document_course.txt'))
+SOURCE_DIR = config('MTSS_SOURCE_DIR',default=os.path.join(ASSETS_DIR,'json_source_files'))
 
 class AssetLoader:
 
@@ -27,6 +34,44 @@ class AssetLoader:
 
 		return queries
 
+	@staticmethod
+	def get_paraphrases():
+
+		# hand-written rewordings of get_queries entries, used to calibrate the semantic cache threshold
+		paraphrase_pairs = [("We are just starting with MTSS. What are the core features of the framework. Where should we begin?",
+							"We are new to MTSS. What are the framework's core features and where do we start?"),
+							("Discuss the barriers to implement an integrated MTSS framework.",
+							"What barriers get in the way of implementing an integrated MTSS framework?"),
+							("Why do schools struggle to integrate school behavioral health services into their MTSS",
+							"Why is it hard for schools to integrate behavioral health services into MTSS?"),
+							("List the responsibilities of an LPC, LMSW, LMFT within a school building integrated MTSS framework.",
+							"What are the responsibilities of an LPC, LMSW or LMFT in a school's integrated MTSS framework?"),
+							("Can you share with me, in a simple way, what RTI (Response to Intervention) is? How is it different than MTSS?",
+							"In simple terms, what is RTI (Response to Intervention) and how does it differ from MTSS?"),
+							("Why do schools struggle to integrate school behavioral health services into their MTSS",
+							"Discuss the barriers to implement an integrated MTSS framework.")]
+
+		return paraphrase_pairs
+
+	@staticmethod
+	def get_distinct_pairs():
+
+		# hand-labelled pairs of get_queries entries that ask different things and must not share a cached answer
+		distinct_pairs = [("What is MTSS, PBIS, ISF, RTI?  All these acronyms are floating around.  I need succinct answers. My next meeting is in 15 minutes.",
+						"List the responsibilities of an LPC, LMSW, LMFT within a school building integrated MTSS framework."),
+						("We are just starting with MTSS. What are the core features of the framework. Where should we begin?",
+						"I am new to my district and have been invited to join an MTSS team as clinical staff. I am not clear on what they mean when they say I am an MTSS Team member. What is expected of me on this team?"),
+						("Can you share with me, in a simple way, what RTI (Response to Intervention) is? How is it different than MTSS?",
+						"Why do schools struggle to integrate school behavioral health services into their MTSS"),
+						("Discuss the importance of integrating behavioral health into a tiered academic support framework.",
+						"My school does not use a universal screening system. What screeners can I recommend for use that capture internalizing and externalizing behavior? Can you give me a list of all available screening tools and a description of each."),
+						("Briefly describe MTSS and the process of integrating behavioral health support into an existing academic framework.",
+						"List the responsibilities of an LPC, LMSW, LMFT within a school building integrated MTSS framework."),
+						("What are the key concepts in implementing an effective integrated MTSS?",
+						"I work in a large school district.  It seems like every student who has an issue, behavior, emotion, and/or mental health is immediately referred to me.  I cant keep up.  What can I do to inform a more preventative approach in my school?")]
+
+		return distinct_pairs
+
 	@staticmethod
 	def get_templates():
 
@@ -73,11 +118,26 @@ class AssetLoader:
 
 		return system_templates
 
+	@staticmethod
+	def course_file():
+
+		return COURSE_FILE
+
+	@staticmethod
+	def source_dir():
+
+		return SOURCE_DIR
+
+	@staticmethod
+	def source_files():
+
+		natural_key = lambda path: [int(part) if part.isdigit() else part for part in re.split(r'(\d+)',os.path.basename(path))]
+		return sorted(glob.glob(os.path.join(SOURCE_DIR,'*.txt')),key=natural_key)
+
 	@staticmethod
 	def read_data():
 
-		f = open('/teamspace/studios/this_studio/MTSS-Copilots/src/assets/Final_txt_document_course.txt')
-		f_lines = f.read().splitlines()
-		f_str = ''.join([re.sub(r'[^A-Za-z0-9 ]+', '' ,line) for line in f_lines if re.sub(r'[^A-Za-z0-9 ]+', '' ,line)])
-		f.close()
-		return f_str
\ No newline at end of file
+		with open(AssetLoader.course_file()) as f:
+			f_lines = f.read().splitlines()
+		cleaned_lines = [re.sub(r'[^A-Za-z0-9 ]+', '' ,line) for line in f_lines]
+		return ''.join([line for line in cleaned_lines if line])
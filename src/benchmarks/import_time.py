@@ -0,0 +1,49 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['torch', 'flair', 'transformers', 'bs4', 'requests', 'groq', 'rouge_score', 'nltk', 'tqdm']
+
+# runs in a fresh interpreter: import the module, then exercise the symbolic-only
+# retrieval path used by main.py, and report timings plus any heavy module loaded
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import copilots.Memory_Utils as Memory_Utils
+imported = time.perf_counter()
+splits = ['MTSS is a multi-tiered system of supports', 'Tier 1 supports all students', 'Tier 3 is intensive']
+index = Memory_Utils.Lexical_Index.build(splits)
+Memory_Utils.Retr.retrieve_context(splits, 'what is MTSS', symb_model=Memory_Utils.Symbolic_Model(), top_k=1, symbolic_index=index)
+done = time.perf_counter()
+print(json.dumps({'import_seconds': imported - start, 'symbolic_seconds': done - imported,
+                  'heavy_modules': sorted(name for name in HEAVY_MODULES if name in sys.modules)}))
+"""
+
+def run_probe():
+
+    code = 'HEAVY_MODULES = ' + repr(HEAVY_MODULES) + '\n' + PROBE
+    output = subprocess.run([sys.executable, '-c', code], cwd=SRC_DIR, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='import-time benchmark for copilots.Memory_Utils')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=0.5, help='fail when the median import time exceeds this many seconds')
+    args = parser.parse_args()
+
+    probes = [run_probe() for _ in range(args.runs)]
+    import_seconds = statistics.median(probe['import_seconds'] for probe in probes)
+    symbolic_seconds = statistics.median(probe['symbolic_seconds'] for probe in probes)
+    heavy_modules = sorted(set(name for probe in probes for name in probe['heavy_modules']))
+
+    print (f'import copilots.Memory_Utils: median {import_seconds*1000:.1f} ms over {args.runs} runs')
+    print (f'symbolic retrieval path: median {symbolic_seconds*1000:.1f} ms')
+    print (f'heavy modules loaded: {heavy_modules or "none"}')
+
+    if heavy_modules or import_seconds > args.budget:
+        print ('FAIL: import-time regression')
+        sys.exit(1)
@@ -0,0 +1,24 @@
+import time
+from argparse import ArgumentParser
+from assets.DataUtils import AssetLoader
+from copilots.Memory_Utils import Corpus_Snapshot, SNAPSHOT_DIR
+
+# normalizes and chunks the course text and the source shards once, ahead of deployment,
+# so the copilots only memory-map the resulting snapshots at startup
+
+def build_corpus(snapshot_dir=SNAPSHOT_DIR, max_tokens=256, overlap=32):
+
+    corpora = {'course': [AssetLoader.course_file()], 'shards': AssetLoader.source_files()}
+    for name, paths in corpora.items():
+        start_time = time.time()
+        version = Corpus_Snapshot.build(name, paths, snapshot_dir=snapshot_dir, max_tokens=max_tokens, overlap=overlap)
+        snapshot = Corpus_Snapshot.load(name, snapshot_dir=snapshot_dir)
+        print (f'{name}: {len(paths)} files -> {len(snapshot)} chunks, snapshot {version} ({time.time() - start_time:.2f}s)')
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='builds the precompiled corpus snapshots')
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR)
+    parser.add_argument('--max-tokens', type=int, default=256)
+    parser.add_argument('--overlap', type=int, default=32)
+    args = parser.parse_args()
+    build_corpus(args.snapshot_dir, max_tokens=args.max_tokens, overlap=args.overlap)
@@ -1,20 +1,621 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import time
+import threading
+import httpx
 from json import loads
 from decouple import config
-from groq import Groq
+import groq
+from groq import AsyncGroq, Groq
+
+TIKTOKEN_CACHE_DIR = config('TIKTOKEN_CACHE_DIR',default=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','assets','tiktoken_cache'))
+
+class Client_Pool:
+
+    clients = {}
+    async_clients = {}
+    lock = threading.Lock()
+    limits = {'max_connections': config('LLM_MAX_CONNECTIONS',default=20,cast=int),
+              'max_keepalive_connections': config('LLM_MAX_KEEPALIVE_CONNECTIONS',default=10,cast=int),
+              'keepalive_expiry': config('LLM_KEEPALIVE_EXPIRY',default=120.0,cast=float)}
+
+    @staticmethod
+    def configure(**limits):
+        """
+        sets connection pool limits for clients created after this call
+        """
+
+        Client_Pool.limits.update(limits)
+
+    @staticmethod
+    def get(api='GROQ',model=None):
+        """
+        returns the shared client of a provider and model, creating it with a keep-alive connection pool on first use
+        """
+
+        key = (api,model)
+        with Client_Pool.lock:
+            if not key in Client_Pool.clients:
+                if api != 'GROQ':
+                    raise ValueError(f'unsupported LLM api: {api}')
+                http_client = httpx.Client(limits=httpx.Limits(**Client_Pool.limits),timeout=httpx.Timeout(60.0,connect=10.0))
+                Client_Pool.clients[key] = Groq(api_key=config('GROQ_API_KEY'),http_client=http_client,max_retries=0)
+            return Client_Pool.clients[key]
+
+    @staticmethod
+    def get_async(api='GROQ',model=None):
+        """
+        returns the shared async client of a provider and model for the running event loop
+        """
+
+        key = (api,model,asyncio.get_running_loop())
+        with Client_Pool.lock:
+            # clients of loops that were closed without aclose() can no longer be used, drop them with their loops
+            for stale_key in [stale_key for stale_key in Client_Pool.async_clients if stale_key[2].is_closed()]:
+                Client_Pool.async_clients.pop(stale_key)
+            if not key in Client_Pool.async_clients:
+                if api != 'GROQ':
+                    raise ValueError(f'unsupported LLM api: {api}')
+                http_client = httpx.AsyncClient(limits=httpx.Limits(**Client_Pool.limits),timeout=httpx.Timeout(60.0,connect=10.0))
+                Client_Pool.async_clients[key] = AsyncGroq(api_key=config('GROQ_API_KEY'),http_client=http_client,max_retries=0)
+            return Client_Pool.async_clients[key]
+
+    @staticmethod
+    async def aclose():
+        """
+        closes the async clients bound to the running event loop
+        """
+
+        loop = asyncio.get_running_loop()
+        with Client_Pool.lock:
+            keys = [key for key in Client_Pool.async_clients if key[2] is loop]
+            clients = [Client_Pool.async_clients.pop(key) for key in keys]
+        for client in clients:
+            await client.close()
+
+    @staticmethod
+    def close_async(loop,client):
+        """
+        closes an async client from outside its event loop, best effort once the loop is gone
+        """
+
+        try:
+            current_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            current_loop = None
+        try:
+            if loop.is_closed():
+                asyncio.run(client.close())
+            elif loop.is_running():
+                # a loop running in another thread closes its own client, the current one cannot block on itself
+                if not loop is current_loop:
+                    asyncio.run_coroutine_threadsafe(client.close(),loop).result(timeout=10.0)
+            else:
+                loop.run_until_complete(client.close())
+        except Exception:
+            pass
+
+    @staticmethod
+    def shutdown():
+        """
+        closes every pooled client and its connections
+        """
+
+        with Client_Pool.lock:
+            clients = list(Client_Pool.clients.values())
+            async_clients = list(Client_Pool.async_clients.items())
+            Client_Pool.clients.clear()
+            Client_Pool.async_clients.clear()
+        for client in clients:
+            client.close()
+        for (api, model, loop), client in async_clients:
+            Client_Pool.close_async(loop,client)
+
+atexit.register(Client_Pool.shutdown)
+
+class LLM_Error(Exception):
+
+    def __init__(self,message,status_code=None,retry_after=None):
+
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class LLM_Retryable_Error(LLM_Error):
+    pass
+
+class LLM_Fatal_Error(LLM_Error):
+    pass
+
+class Token_Bucket:
+
+    def __init__(self,per_minute,capacity=None):
+
+        self.rate = per_minute/60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self,amount=1):
+        """
+        takes amount tokens from the bucket and returns how many seconds the caller must wait before using them
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,self.tokens + (now - self.updated)*self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return max(0.0,-self.tokens)/self.rate
+
+class Request_Scheduler:
+
+    shared = {}
+
+    def __init__(self,requests_per_minute=30,tokens_per_minute=0,max_retries=5,base_delay=1.0,max_delay=60.0):
+
+        self.request_bucket = Token_Bucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = Token_Bucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def get_shared(api='GROQ',model=None):
+        """
+        returns the process-wide scheduler of a provider and model, limits read from
+        LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE and LLM_MAX_RETRIES
+        """
+
+        key = (api,model)
+        with Client_Pool.lock:
+            if not key in Request_Scheduler.shared:
+                Request_Scheduler.shared[key] = Request_Scheduler(requests_per_minute=config('LLM_REQUESTS_PER_MINUTE',default=30,cast=int),
+                                                                  tokens_per_minute=config('LLM_TOKENS_PER_MINUTE',default=0,cast=int),
+                                                                  max_retries=config('LLM_MAX_RETRIES',default=5,cast=int))
+            return Request_Scheduler.shared[key]
+
+    @staticmethod
+    def estimate_tokens(prompt):
+
+        return max(1,Token_Counter.count(prompt))
+
+    @staticmethod
+    def retry_after(response):
+        """
+        returns the Retry-After delay of an http response in seconds, or None
+        """
+
+        if response is None:
+            return None
+        value = response.headers.get('retry-after')
+        try:
+            return max(0.0,float(value)) if value is not None else None
+        except ValueError:
+            return None
+
+    @staticmethod
+    def classify(error):
+        """
+        wraps a provider exception as a retryable or fatal LLM_Error
+        """
+
+        if isinstance(error,LLM_Error):
+            return error
+        if isinstance(error,(groq.APITimeoutError,groq.APIConnectionError,asyncio.TimeoutError,TimeoutError)):
+            return LLM_Retryable_Error(f'{type(error).__name__}: {error}')
+        if isinstance(error,groq.APIStatusError):
+            status_code = error.status_code
+            retry_after = Request_Scheduler.retry_after(error.response)
+            if status_code in (408,409,429) or status_code >= 500:
+                return LLM_Retryable_Error(f'{type(error).__name__}: {error}',status_code=status_code,retry_after=retry_after)
+            return LLM_Fatal_Error(f'{type(error).__name__}: {error}',status_code=status_code)
+        return LLM_Fatal_Error(f'{type(error).__name__}: {error}')
+
+    def wait_time(self,tokens):
+
+        waits = [0.0]
+        if not self.request_bucket is None:
+            waits.append(self.request_bucket.reserve(1))
+        if not self.token_bucket is None:
+            waits.append(self.token_bucket.reserve(tokens))
+        return max(waits)
+
+    def backoff(self,attempt,error):
+        """
+        returns the delay before the next attempt, honouring Retry-After, otherwise full-jitter exponential backoff
+        """
+
+        if not error.retry_after is None:
+            return error.retry_after + random.uniform(0,self.base_delay)
+        return random.uniform(0,min(self.max_delay,self.base_delay*2**attempt))
+
+    def run(self,request,tokens=1):
+        """
+        calls request under the rate limits, retrying retryable failures and raising LLM_Error otherwise
+        """
+
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self.wait_time(tokens))
+            try:
+                return request()
+            except Exception as e:
+                error = Request_Scheduler.classify(e)
+                if isinstance(error,LLM_Fatal_Error) or attempt == self.max_retries:
+                    raise error from e
+                time.sleep(self.backoff(attempt,error))
+
+    async def arun(self,request,tokens=1):
+        """
+        async version of run, request returns a new awaitable on every call
+        """
+
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self.wait_time(tokens))
+            try:
+                return await request()
+            except Exception as e:
+                error = Request_Scheduler.classify(e)
+                if isinstance(error,LLM_Fatal_Error) or attempt == self.max_retries:
+                    raise error from e
+                await asyncio.sleep(self.backoff(attempt,error))
+
+class Response_Cache:
+
+    shared = None
+
+    def __init__(self,path=None,ttl=None,max_entries=10000):
+
+        self.path = path or config('LLM_CACHE_PATH',default=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','assets','llm_cache.sqlite'))
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path,check_same_thread=False)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, response TEXT, created REAL, accessed REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+    @staticmethod
+    def get_shared():
+        """
+        returns the process-wide cache configured from LLM_CACHE_TTL and LLM_CACHE_MAX_ENTRIES
+        """
+
+        with Client_Pool.lock:
+            if Response_Cache.shared is None:
+                Response_Cache.shared = Response_Cache(ttl=config('LLM_CACHE_TTL',default=0.0,cast=float) or None,
+                                                       max_entries=config('LLM_CACHE_MAX_ENTRIES',default=10000,cast=int))
+            return Response_Cache.shared
+
+    @staticmethod
+    def make_key(model,prompt,**params):
+        """
+        returns a hash of the model, prompt and generation parameters
+        """
+
+        payload = json.dumps({'model': model, 'prompt': prompt, 'params': params},sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self,key):
+        """
+        returns the cached response of a key, or None if it is missing or older than the ttl
+        """
+
+        now = time.time()
+        with self.lock, self.connection:
+            row = self.connection.execute('SELECT response, created FROM responses WHERE key = ?',(key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self.connection.execute('DELETE FROM responses WHERE key = ?',(key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute('UPDATE responses SET accessed = ? WHERE key = ?',(now,key))
+            self.hits += 1
+            return row[0]
+
+    def put(self,key,model,response):
+        """
+        stores a response and evicts the least recently used entries beyond max_entries
+        """
+
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',(key,model,response,now,now))
+            n_entries = self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            if n_entries > self.max_entries:
+                self.connection.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)',(n_entries - self.max_entries,))
+
+    def stats(self):
+
+        with self.lock:
+            n_entries = self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': n_entries}
+
+    def clear(self):
+
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM responses')
+
+    def close(self):
+
+        with self.lock:
+            self.connection.close()
+
+class Token_Counter:
+
+    encoding = None
+    word_pattern = re.compile(r'\w+|[^\w\s]')
+
+    @staticmethod
+    def is_provisioned(name,cache_dir):
+        """
+        checks whether the bpe file of a tiktoken encoding is already in cache_dir, where tiktoken
+        stores it under the sha1 of its download url
+        """
+
+        blob_url = f'https://openaipublic.blob.core.windows.net/encodings/{name}.tiktoken'
+        return os.path.exists(os.path.join(cache_dir,hashlib.sha1(blob_url.encode('utf-8')).hexdigest()))
+
+    @staticmethod
+    def get_encoding():
+        """
+        returns the tiktoken encoding named by LLM_TOKENIZER when its bpe file is provisioned in TIKTOKEN_CACHE_DIR
+        (or downloads are allowed with LLM_TOKENIZER_DOWNLOAD), otherwise False and tokens are approximated
+        by words and punctuation, tiktoken is never asked to reach the network on its own
+        """
+
+        if Token_Counter.encoding is None:
+            name = config('LLM_TOKENIZER',default='cl100k_base')
+            Token_Counter.encoding = False
+            if Token_Counter.is_provisioned(name,TIKTOKEN_CACHE_DIR) or config('LLM_TOKENIZER_DOWNLOAD',default=False,cast=bool):
+                os.environ['TIKTOKEN_CACHE_DIR'] = TIKTOKEN_CACHE_DIR
+                try:
+                    import tiktoken
+                    Token_Counter.encoding = tiktoken.get_encoding(name)
+                except Exception:
+                    Token_Counter.encoding = False
+        return Token_Counter.encoding
+
+    @staticmethod
+    def count(text):
+
+        encoding = Token_Counter.get_encoding()
+        if encoding:
+            return len(encoding.encode(text,disallowed_special=()))
+        return len(Token_Counter.word_pattern.findall(text))
+
+    @staticmethod
+    def truncate(text,max_tokens,keep='head'):
+        """
+        returns the first (keep='head') or last (keep='tail') max_tokens tokens of the text
+        """
+
+        if max_tokens <= 0:
+            return ''
+        encoding = Token_Counter.get_encoding()
+        if encoding:
+            tokens = encoding.encode(text,disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            return encoding.decode(tokens[:max_tokens] if keep == 'head' else tokens[-max_tokens:])
+        spans = [match.span() for match in Token_Counter.word_pattern.finditer(text)]
+        if len(spans) <= max_tokens:
+            return text
+        return text[:spans[max_tokens-1][1]] if keep == 'head' else text[spans[-max_tokens][0]:]
+
+    @staticmethod
+    def split(text,max_tokens):
+        """
+        returns consecutive pieces of the text of at most max_tokens tokens each
+        """
+
+        encoding = Token_Counter.get_encoding()
+        if encoding:
+            tokens = encoding.encode(text,disallowed_special=())
+            return [encoding.decode(tokens[start:start+max_tokens]) for start in range(0,len(tokens),max_tokens)]
+        spans = [match.span() for match in Token_Counter.word_pattern.finditer(text)]
+        starts = [spans[start][0] if start else 0 for start in range(0,len(spans),max_tokens)]
+        return [text[start:end] for start, end in zip(starts,starts[1:]+[len(text)])]
+
+class Prompt_Builder:
+
+    separator = '\n ===== \n'
+
+    def __init__(self,max_prompt_tokens=6000,min_chunk_tokens=32):
+
+        self.max_prompt_tokens = max_prompt_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+
+    @staticmethod
+    def rank_chunks(content):
+        """
+        returns content as a list of text chunks, highest score first; accepts a string, a list of strings
+        in rank order, (text, score) pairs or retrieval results with 'split' and 'score'
+        """
+
+        if content is None:
+            return []
+        if isinstance(content,str):
+            return [content]
+        scored = []
+        for rank, item in enumerate(content):
+            if isinstance(item,dict):
+                scored.append((item.get('score',0.0),-rank,item['split']))
+            elif isinstance(item,(tuple,list)):
+                scored.append((item[1],-rank,item[0]))
+            else:
+                scored.append((None,-rank,str(item)))
+        if all(score is not None for score, _, _ in scored):
+            scored.sort(key=lambda item: (item[0],item[1]),reverse=True)
+        return [text for _, _, text in scored]
+
+    def pack(self,chunks,budget,keep='head'):
+        """
+        greedily packs chunks in order up to budget tokens, truncating the first chunk that
+        overflows when at least min_chunk_tokens remain, returns the packed chunks and their stats
+        """
+
+        packed, used, truncated = [], 0, False
+        separator_tokens = Token_Counter.count(Prompt_Builder.separator)
+        total_tokens = 0
+        for chunk in chunks:
+            chunk_tokens = Token_Counter.count(chunk)
+            total_tokens += chunk_tokens
+            cost = chunk_tokens + (separator_tokens if packed else 0)
+            if used + cost <= budget and not truncated:
+                packed.append(chunk)
+                used += cost
+                continue
+            remaining = budget - used - (separator_tokens if packed else 0)
+            if not truncated and remaining >= min(self.min_chunk_tokens,chunk_tokens):
+                packed.append(Token_Counter.truncate(chunk,remaining,keep=keep))
+                used += Token_Counter.count(packed[-1]) + (separator_tokens if len(packed) > 1 else 0)
+            truncated = True
+        stats = {'context_chunks': len(chunks), 'context_chunks_used': len(packed), 'context_tokens_available': total_tokens,
+                 'context_tokens': used, 'truncated': truncated}
+        return packed, stats
+
+    def build(self,render,content,keep='head'):
+        """
+        renders the prompt with content packed into whatever the template leaves of max_prompt_tokens
+        """
+
+        template_tokens = Token_Counter.count(render(''))
+        chunks = Prompt_Builder.rank_chunks(content)
+        if keep == 'tail':
+            chunks = chunks[::-1]
+        packed, stats = self.pack(chunks,max(self.max_prompt_tokens - template_tokens,0),keep=keep)
+        if keep == 'tail':
+            packed = packed[::-1]
+        prompt = render(Prompt_Builder.separator.join(packed))
+        stats.update(template_tokens=template_tokens,prompt_tokens=Token_Counter.count(prompt),max_prompt_tokens=self.max_prompt_tokens)
+        return prompt, stats
+
+class Json_Stream_Extractor:
+
+    def __init__(self,key='Response'):
+
+        self.key_pattern = re.compile(r'"'+re.escape(key)+r'"\s*:\s*"')
+        self.buffer = ''
+        self.position = 0
+        self.started = False
+        self.done = False
+        self.value = ''
+
+    def feed(self,chunk):
+        """
+        consumes the next chunk of raw model output and returns the newly decoded part of the json string value of key
+        """
+
+        self.buffer += chunk
+        if self.done:
+            return ''
+        if not self.started:
+            match = self.key_pattern.search(self.buffer)
+            if match is None:
+                return ''
+            self.started = True
+            self.position = match.end()
+
+        decoded, buffer, i = [], self.buffer, self.position
+        escapes = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.done = True
+                i += 1
+                break
+            if char != '\\':
+                decoded.append(char)
+                i += 1
+                continue
+            if i + 1 >= len(buffer):
+                break
+            if buffer[i+1] == 'u':
+                if i + 6 > len(buffer):
+                    break
+                try:
+                    decoded.append(chr(int(buffer[i+2:i+6],16)))
+                except ValueError:
+                    decoded.append(buffer[i:i+6])
+                i += 6
+                continue
+            decoded.append(escapes.get(buffer[i+1],buffer[i+1]))
+            i += 2
+        self.position = i
+        piece = ''.join(decoded)
+        self.value += piece
+        return piece
+
+    @staticmethod
+    def extract(llm_response,key='Response'):
+        """
+        returns the json string value of key in a complete response, or the raw response if there is none
+        """
+
+        extractor = Json_Stream_Extractor(key)
+        extractor.feed(llm_response)
+        return extractor.value if extractor.started else llm_response
 
 class LLM:
 
-    def __init__(self,api='GROQ',groq_model="mixtral-8x7b-32768"):
+    def __init__(self,api='GROQ',groq_model="mixtral-8x7b-32768",use_cache=None,cache=None):
 
+        self.api = api
+        self.generation_params = {'temperature': 0.0}
+        if use_cache is None:
+            use_cache = config('LLM_CACHE',default=True,cast=bool)
+        self.cache = (cache or Response_Cache.get_shared()) if use_cache else None
+        self.scheduler = Request_Scheduler.get_shared(api,groq_model)
+        self.stream_stats = None
+        self.prompt_stats = None
+        self.max_prompt_tokens = config('LLM_MAX_PROMPT_TOKENS',default=6000,cast=int)
         if api == 'GROQ':
-            api_key = config('GROQ_API_KEY')
-            self.groq_client = Groq(api_key=api_key)
+            self.groq_client = Client_Pool.get(api,groq_model)
             self.groq_model = groq_model
 
-    def set_prompt(self,system_template=None,user_query=None,context=None,summary_content=None):
+    def set_prompt(self,system_template=None,user_query=None,context=None,summary_content=None,max_prompt_tokens=None,running_summary=None):
+        """
+        builds the prompt, packing context or summary content into the prompt token budget,
+        token counts used are recorded in prompt_stats
+        """
+
+        prompt_builder = Prompt_Builder(max_prompt_tokens=max_prompt_tokens or self.max_prompt_tokens)
+
+        if not summary_content is None and not running_summary is None:
+            render = lambda summary_content: f"""
+            Update the running summary below with the new information.
+
+            ------ RUNNING SUMMARY -----
+
+            {running_summary}
+
+            ------ NEW INFORMATION -----
+
+            {summary_content}
+
+            Keep everything important from the running summary and stay concise.
+            Make sure to respond in JSON format as follows
+            {{"Summary": "your response"}}
+
+            """
+
+            prompt, self.prompt_stats = prompt_builder.build(render,summary_content,keep='tail')
+            self.prompt = prompt
+            return prompt
 
         if not summary_content is None:
-            prompt = f"""
+            render = lambda summary_content: f"""
             Summarize the information below:
 
             ------ INFORMATION -----
@@ -26,10 +627,11 @@ class LLM:
 
             """
 
+            prompt, self.prompt_stats = prompt_builder.build(render,summary_content,keep='tail')
             self.prompt = prompt
-            return None
+            return prompt
 
-        prompt = f"""
+        render = lambda context: f"""
         Consider the user query below:
 
         ------ USER QUERY -----
@@ -53,17 +655,24 @@ class LLM:
 
         """   
 
-        self.prompt = prompt     
+        prompt, self.prompt_stats = prompt_builder.build(render,context)
+        self.prompt = prompt
+        return prompt
 
     def respond_to_prompt(self):
         """
-        returns llm response based on prompt
+        returns llm response based on prompt, raises LLM_Error when the request fails
         """
 
         prompt = self.prompt
 
-        try:
+        cache_key = Response_Cache.make_key(self.groq_model,prompt,**self.generation_params)
+        if not self.cache is None:
+            llm_response = self.cache.get(cache_key)
+            if not llm_response is None:
+                return llm_response
 
+        def request():
             client = self.groq_client
             chat_completion = client.chat.completions.create(
                 messages=[
@@ -72,16 +681,197 @@ class LLM:
                         "content": prompt,
                         }
                         ],
-                        temperature = 0.0,
                         model=self.groq_model,
+                        **self.generation_params,
                         )
+            return str(chat_completion.choices[0].message.content)
 
-            llm_response = llm_response_string = str(chat_completion.choices[0].message.content)
-            #json_object_in_response = '{'+llm_response.split('{')[1].split('}')[0]+'}'
-            return llm_response
+        llm_response = self.scheduler.run(request,tokens=Request_Scheduler.estimate_tokens(prompt))
+        #json_object_in_response = '{'+llm_response.split('{')[1].split('}')[0]+'}'
+        if not self.cache is None:
+            self.cache.put(cache_key,self.groq_model,llm_response)
+        return llm_response
 
+    def stream_response(self,prompt=None,extract_key=None):
+        """
+        yields the llm response chunk by chunk as it is generated, or only the json string value
+        of extract_key when given (falling back to the raw response if the model never emits it),
+        records time to first token, stream chunks, tokens and tokens per second in stream_stats
+        """
+
+        prompt = self.prompt if prompt is None else prompt
+        start_time = time.monotonic()
+        extractor = None if extract_key is None else Json_Stream_Extractor(extract_key)
+
+        cache_key = Response_Cache.make_key(self.groq_model,prompt,**self.generation_params)
+        llm_response = None if self.cache is None else self.cache.get(cache_key)
+        if not llm_response is None:
+            self.stream_stats = {'cached': True, 'time_to_first_token': 0.0, 'chunks': 0, 'tokens': Token_Counter.count(llm_response),
+                                 'tokens_per_sec': None, 'total_time': time.monotonic() - start_time}
+            piece = llm_response if extractor is None else extractor.feed(llm_response)
+            yield piece if extractor is None or extractor.started else llm_response
+            return
+
+        def request():
+            return self.groq_client.chat.completions.create(
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt,
+                        }
+                        ],
+                        model=self.groq_model,
+                        stream=True,
+                        **self.generation_params,
+                        )
+
+        stream = self.scheduler.run(request,tokens=Request_Scheduler.estimate_tokens(prompt))
+        pieces, first_token_time, n_chunks = [], None, 0
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if not content:
+                    continue
+                if first_token_time is None:
+                    first_token_time = time.monotonic()
+                n_chunks += 1
+                pieces.append(content)
+                piece = content if extractor is None else extractor.feed(content)
+                if piece:
+                    yield piece
         except Exception as e:
-            print (e)
-            print ("Unsupported LLM api or JSON parsing error ...")
-            exit()
-    
\ No newline at end of file
+            raise Request_Scheduler.classify(e) from e
+        finally:
+            stream.response.close()
+
+        end_time = time.monotonic()
+        llm_response = ''.join(pieces)
+        if not extractor is None and not extractor.started and llm_response:
+            yield llm_response
+        generation_time = end_time - first_token_time if not first_token_time is None else 0.0
+        n_tokens = Token_Counter.count(llm_response)
+        self.stream_stats = {'cached': False,
+                             'time_to_first_token': None if first_token_time is None else first_token_time - start_time,
+                             'chunks': n_chunks,
+                             'tokens': n_tokens,
+                             'tokens_per_sec': n_tokens/generation_time if generation_time > 0 else None,
+                             'total_time': end_time - start_time}
+        if not self.cache is None:
+            self.cache.put(cache_key,self.groq_model,llm_response)
+
+    async def arespond_to_prompt(self,prompt=None,timeout=None):
+        """
+        returns llm response based on prompt without blocking the event loop, raises LLM_Error when the request fails
+        """
+
+        prompt = self.prompt if prompt is None else prompt
+        cache_key = Response_Cache.make_key(self.groq_model,prompt,**self.generation_params)
+        if not self.cache is None:
+            llm_response = self.cache.get(cache_key)
+            if not llm_response is None:
+                return llm_response
+
+        client = Client_Pool.get_async(self.api,self.groq_model)
+
+        async def request():
+            chat_completion = await asyncio.wait_for(client.chat.completions.create(
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt,
+                        }
+                        ],
+                        model=self.groq_model,
+                        **self.generation_params,
+                        ),timeout)
+            return str(chat_completion.choices[0].message.content)
+
+        llm_response = await self.scheduler.arun(request,tokens=Request_Scheduler.estimate_tokens(prompt))
+        if not self.cache is None:
+            self.cache.put(cache_key,self.groq_model,llm_response)
+        return llm_response
+
+    async def arespond_many(self,prompts,max_concurrency=4,timeout=None):
+        """
+        answers prompts concurrently with at most max_concurrency requests in flight,
+        returns responses in prompt order with the exception in place of any failed request
+        """
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def respond(prompt):
+            async with semaphore:
+                return await self.arespond_to_prompt(prompt,timeout=timeout)
+
+        return await asyncio.gather(*[respond(prompt) for prompt in prompts],return_exceptions=True)
+
+    def respond_many(self,prompts,max_concurrency=4,timeout=60.0):
+        """
+        blocking wrapper around arespond_many for callers without an event loop
+        """
+
+        async def run():
+            try:
+                return await self.arespond_many(prompts,max_concurrency=max_concurrency,timeout=timeout)
+            finally:
+                await Client_Pool.aclose()
+
+        return asyncio.run(run())
+
+class Rolling_Summarizer:
+
+    def __init__(self,llm=None,max_batch_tokens=3000,max_concurrency=4,max_rounds=4):
+
+        self.llm = llm or LLM()
+        self.max_batch_tokens = max_batch_tokens
+        self.max_rounds = max_rounds
+        self.max_concurrency = max_concurrency
+        self.summary = ''
+        self.n_folded = 0
+
+    @staticmethod
+    def extract_summary(llm_response):
+        """
+        returns the "Summary" value of a json response, or the raw response if there is none
+        """
+
+        return Json_Stream_Extractor.extract(llm_response,'Summary')
+
+    def reduce(self,information):
+        """
+        summarizes information larger than max_batch_tokens piece by piece until it fits one batch,
+        truncating it once max_rounds pass or a round stops shrinking it
+        """
+
+        n_tokens = Token_Counter.count(information)
+        for _ in range(self.max_rounds):
+            if n_tokens <= self.max_batch_tokens:
+                return information
+            pieces = Token_Counter.split(information,self.max_batch_tokens)
+            prompts = [self.llm.set_prompt(summary_content=piece) for piece in pieces]
+            partial_summaries = self.llm.respond_many(prompts,max_concurrency=self.max_concurrency)
+            for partial_summary in partial_summaries:
+                if isinstance(partial_summary,Exception):
+                    raise partial_summary
+            reduced = '\n'.join([Rolling_Summarizer.extract_summary(partial_summary) for partial_summary in partial_summaries])
+            reduced_tokens = Token_Counter.count(reduced)
+            if reduced_tokens >= n_tokens:
+                break
+            information, n_tokens = reduced, reduced_tokens
+        return Token_Counter.truncate(information,self.max_batch_tokens)
+
+    def fold(self,new_information):
+        """
+        folds new information into the running summary with one llm call and returns the updated summary
+        """
+
+        new_information = self.reduce(str(new_information))
+        if self.summary:
+            self.llm.set_prompt(summary_content=new_information,running_summary=self.summary)
+        else:
+            self.llm.set_prompt(summary_content=new_information)
+        self.summary = Rolling_Summarizer.extract_summary(self.llm.respond_to_prompt())
+        self.n_folded += 1
+        return self.summary
@@ -1,107 +1,146 @@
-import requests
 import json
-import torch
+import glob
+import hashlib
+import heapq
+import math
+import os
+import numpy as np
 import time
-import nltk
 import re
-import torch.nn as nn
-from flair.embeddings import TransformerDocumentEmbeddings
-from flair.data import Sentence
-from bs4 import BeautifulSoup
-from tqdm import tqdm
+import sys
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from decouple import config
-from groq import Groq
-from random import choice
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.translate.bleu_score import SmoothingFunction
-from rouge_score import rouge_scorer
 
-nltk.download('punkt')
-nltk.download('wordnet')
+# torch, flair and nltk are imported inside the functions that use them so that the
+# symbolic-only retrieval path starts fast and never loads a deep learning stack
+
+NLTK_DATA_DIR = config('NLTK_DATA',default=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','assets','nltk_data'))
+SNAPSHOT_DIR = config('MTSS_SNAPSHOT_DIR',default=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','assets','snapshots'))
+SENTENCE_MODEL = config('MTSS_SENTENCE_MODEL',default='sentence-transformers/all-MiniLM-L6-v2')
+CACHE_THRESHOLD = config('MTSS_CACHE_THRESHOLD',default=0.92,cast=float)
+INDEX_DIR = config('MTSS_INDEX_DIR',default=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','assets','index_cache'))
+
+class Nltk_Resources:
+
+    @staticmethod
+    def require(resource,name):
+        """
+        imports nltk and makes sure a resource (e.g. 'tokenizers/punkt') is provisioned locally,
+        never downloads it
+        """
+
+        import nltk
+        if not NLTK_DATA_DIR in nltk.data.path:
+            nltk.data.path.insert(0,NLTK_DATA_DIR)
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            raise LookupError(f"NLTK resource '{name}' was not found in {nltk.data.path}. "
+                              f"Provision it ahead of time with: python -m nltk.downloader -d {NLTK_DATA_DIR} {name} "
+                              f"(or point the NLTK_DATA setting at an existing data directory)") from None
+        return nltk
 
 class Cluster_Model:
     
-    def __init__(self,max_depth=4):
+    def __init__(self,max_depth=None,n_clusters=None):
         self.max_depth = max_depth
-        self.index = {}
-        self.clusters = {}
-        self.cos = nn.CosineSimilarity(dim=0, eps=1e-6)
-
-    def find_closest_and_avg(self):
-
-        min_sim, closest_pair = 1.0, (0,0)
-        min_i, min_j = None, None
-        for frozen_vector_i in self.index:
-            v_i = torch.tensor(list(frozen_vector_i))
-            v_i_idx = self.index[frozen_vector_i]
-            for frozen_vector_j in self.index:
-                v_j = torch.tensor(list(frozen_vector_j))
-                v_j_idx = self.index[frozen_vector_j]
-                if v_i_idx == v_j_idx:
-                    continue
-                sim_i_j = self.cos(v_i,v_j)
-                if sim_i_j <= min_sim:
-                    min_sim = sim_i_j
-                    closest_pair = (v_i_idx,v_j_idx)
-                    min_i, min_j = v_i, v_j
+        self.n_clusters = n_clusters
+        self.merges = []
+        self.labels = None
+        self.centroids = None
 
-        vector_pair = torch.stack([min_i,min_j])
-        mean_repr = torch.mean(vector_pair,dim=0)
-        return mean_repr, (closest_pair,min_sim)
+    def find_merges(self,vectors):
+        """
+        runs average-linkage agglomerative clustering with a nearest-neighbour chain,
+        returns (point i, point j, similarity) merges sorted from most to least similar
+        """
 
-    def cluster(self,demo_text_split_vectors,cut_threshold=0.0):
-        n_vectors = len(demo_text_split_vectors)
-        splits = [str(item)+';' for item in range(n_vectors)]
-        for i in range(n_vectors):
-            vector = demo_text_split_vectors[i]
-            self.index[frozenset(vector.tolist())] = i
+        vectors = Similarity_Search.normalize(vectors)
+        n_vectors = vectors.shape[0]
+        similarities = vectors @ vectors.T
+        np.fill_diagonal(similarities,-np.inf)
+        sizes = np.ones(n_vectors,dtype=np.float32)
+        merges, chain, n_active = [], [], n_vectors
+        active = np.ones(n_vectors,dtype=bool)
 
-        level = 0
-        while True:
+        while n_active > 1:
+            if not chain:
+                chain.append(int(np.flatnonzero(active)[0]))
+            a = chain[-1]
+            b = int(np.argmax(similarities[a]))
+            if len(chain) > 1 and similarities[a,chain[-2]] >= similarities[a,b]:
+                b = chain[-2]
+            if len(chain) > 1 and b == chain[-2]:
+                chain = chain[:-2]
+                merges.append((a,b,float(similarities[a,b])))
+                merged = (sizes[a]*similarities[a] + sizes[b]*similarities[b])/(sizes[a] + sizes[b])
+                merged[~active] = -np.inf
+                merged[a] = -np.inf
+                similarities[a,:] = merged
+                similarities[:,a] = merged
+                similarities[b,:] = -np.inf
+                similarities[:,b] = -np.inf
+                sizes[a] += sizes[b]
+                active[b] = False
+                n_active -= 1
+            else:
+                chain.append(b)
 
-            try:
+        merges.sort(key=lambda merge: -merge[2])
+        return merges
 
-                if level == self.max_depth-1:
-                    break
+    def cluster(self,demo_text_split_vectors,cut_threshold=0.0):
+        """
+        clusters the split vectors and returns the member split indices of each cluster as integer arrays
+        """
 
-                mean_repr, closest_pair = self.find_closest_and_avg()
-                closest_pair_threshold = closest_pair[1]
-                if closest_pair_threshold <= cut_threshold:
-                    break
-                self.index[frozenset(mean_repr.tolist())] = closest_pair[0]
-                for frozen_set in list(self.index.keys()):
-                    if self.index[frozen_set] in closest_pair[0]:
-                        del self.index[frozen_set]
-                level += 1
+        vectors = np.asarray(demo_text_split_vectors,dtype=np.float32)
+        n_vectors = vectors.shape[0]
+        self.merges = self.find_merges(vectors) if n_vectors > 1 else []
 
-            except:
-                break
+        max_merges = n_vectors - 1
+        if not self.n_clusters is None:
+            max_merges = min(max_merges,max(n_vectors - self.n_clusters,0))
+        if not self.max_depth is None:
+            max_merges = min(max_merges,self.max_depth)
 
-        clusters = []
+        parents = list(range(n_vectors))
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
 
-        for frozen_set in self.index:
-            item, new_item = self.index[frozen_set], []
-            if not type(item) == int:
-                new_item += [[int(l) for l in list(re.sub(r'[^0-9]+', '', str(sub_item)))] for sub_item in item]
-            else:
-                new_item += [[item]]
-            split_items = [''.join([splits[sub_sub_item] for sub_sub_item in sub_item]) for sub_item in new_item]
-            clusters += split_items
+        for i, j, similarity in self.merges[:max_merges]:
+            if similarity <= cut_threshold:
+                break
+            root_i, root_j = find(i), find(j)
+            parents[max(root_i,root_j)] = min(root_i,root_j)
 
+        roots = np.array([find(i) for i in range(n_vectors)],dtype=np.int64)
+        _, self.labels = np.unique(roots,return_inverse=True)
+        clusters = [np.flatnonzero(self.labels == label) for label in range(int(self.labels.max()) + 1)] if n_vectors else []
+        self.centroids = np.stack([vectors[members].mean(axis=0) for members in clusters]) if clusters else np.zeros((0,vectors.shape[-1]),dtype=np.float32)
         return clusters
 
-    def prune_splits(self,query,text_splits,top_k=3):
-        
-        neural_net = Neural_Net()
-        query_vector = neural_net.vectorize(query)
-        query_vectors = [query_vector for _ in range(len(text_splits))]
-        split_vectors = [neural_net.vectorize(split) for split in text_splits]
-        similarities = [neural_net.vector_similarity(x[0],x[1]).item() for x in zip(query_vectors,split_vectors)]
-        top_3_idxs = [similarities.index(y) for y in sorted(similarities)[::-1][:top_k]]
+    def prune_splits(self,query,text_splits,top_k=3,neural_net=None):
+
+        if neural_net is None:
+            neural_net = Neural_Net()
+        query_vector = neural_net.vectorize_batch([query])[0]
+        split_vectors = neural_net.vectorize_batch(text_splits)
+        top_3_idxs, _ = Similarity_Search(split_vectors).search(query_vector,top_k=top_k)
         return '\n ===== \n'.join([text_splits[idx] for idx in top_3_idxs])
 
 class Text_Preprocessor:
-    
+
+    SECTION_MARKERS = (b'#####',b'*****',b'@@@@@')
+    # bump when stream_chunks cuts differently so persisted chunks are rebuilt
+    CHUNKER_VERSION = 2
+    CUT_EVERY = 4
+
     @staticmethod
     def text_splitter(text, split_size=4):
         """
@@ -116,9 +155,101 @@ class Text_Preprocessor:
 
         return processed_return_list
 
+    @staticmethod
+    def stream_sentences(path,section_markers=None):
+        """
+        lazily reads a file and yields sentences as lists of (word, start byte, end byte),
+        yields an empty list at every blank line and None at every section marker line
+        """
+
+        section_markers = section_markers or Text_Preprocessor.SECTION_MARKERS
+        words, offset = [], 0
+        with open(path,'rb') as f:
+            for line in f:
+                line_start = offset
+                offset += len(line)
+                stripped = line.strip(b' \t\r\n\x00\x0c')
+                if not stripped or stripped in section_markers:
+                    if words:
+                        yield words
+                        words = []
+                    yield None if stripped else []
+                    continue
+                line_text = line.decode('utf-8',errors='surrogateescape')
+                char_pos, byte_pos = 0, line_start
+                for match in re.finditer(r'\S+',line_text):
+                    byte_pos += len(line_text[char_pos:match.start()].encode('utf-8',errors='surrogateescape'))
+                    word_bytes = match.group().encode('utf-8',errors='surrogateescape')
+                    word = word_bytes.decode('utf-8',errors='replace').replace('\x00','')
+                    if word:
+                        words.append((word,byte_pos,byte_pos + len(word_bytes)))
+                    char_pos, byte_pos = match.end(), byte_pos + len(word_bytes)
+                    if re.search(r'[.!?]["\')\]]*$',word):
+                        yield words
+                        words = []
+        if words:
+            yield words
+
+    @staticmethod
+    def stream_chunks(path,max_tokens=256,overlap=32,section_markers=None):
+        """
+        lazily splits a file into chunks of at most max_tokens words along section and sentence boundaries,
+        consecutive chunks of a section share up to overlap words of trailing sentences,
+        yields dicts with text, start/end byte offsets, token count and section number
+
+        past max_tokens/2 words a chunk ends at the next paragraph break or at a sentence whose hash hits 1 in CUT_EVERY,
+        so the cut points depend on the text around them and an edit only changes the chunks near it
+        """
+
+        def make_chunk(sentences,section):
+            words = [word for sentence in sentences for word in sentence]
+            return {'text': ' '.join([word[0] for word in words]), 'start': words[0][1], 'end': words[-1][2], 'n_tokens': len(words), 'section': section}
+
+        def carry_over(chunk,room):
+            carry, carry_tokens = [], 0
+            for previous in reversed(chunk):
+                if carry_tokens + len(previous) > min(overlap,room):
+                    break
+                carry.insert(0,previous)
+                carry_tokens += len(previous)
+            return carry, carry_tokens
+
+        min_tokens = max_tokens//2
+        chunk, n_tokens, fresh, section = [], 0, False, 0
+        for sentence in Text_Preprocessor.stream_sentences(path,section_markers=section_markers):
+            if sentence is None:
+                if fresh:
+                    yield make_chunk(chunk,section)
+                chunk, n_tokens, fresh = [], 0, False
+                section += 1
+                continue
+            if not sentence:
+                if fresh and n_tokens >= min_tokens:
+                    yield make_chunk(chunk,section)
+                    chunk, n_tokens = carry_over(chunk,max_tokens)
+                    fresh = False
+                continue
+            for start in range(0,len(sentence),max_tokens):
+                piece = sentence[start:start+max_tokens]
+                if n_tokens + len(piece) > max_tokens and fresh:
+                    yield make_chunk(chunk,section)
+                    chunk, n_tokens = carry_over(chunk,max_tokens - len(piece))
+                    fresh = False
+                chunk.append(piece)
+                n_tokens += len(piece)
+                fresh = True
+            if n_tokens >= min_tokens and zlib.crc32(' '.join([word[0] for word in sentence]).encode('utf-8')) % Text_Preprocessor.CUT_EVERY == 0:
+                yield make_chunk(chunk,section)
+                chunk, n_tokens = carry_over(chunk,max_tokens)
+                fresh = False
+        if fresh:
+            yield make_chunk(chunk,section)
+
 class Symbolic_Model:
 
-    def __init__(self):
+    def __init__(self,scoring='bm25'):
+
+        self.scoring = scoring
 
         def vector_similarity(keywords1,keywords2):
             """
@@ -136,20 +267,201 @@ class Symbolic_Model:
             implements a symbolic vectorizer instance
             """
 
-            return word_tokenize(sentence)
+            nltk = Nltk_Resources.require('tokenizers/punkt','punkt')
+            return nltk.tokenize.word_tokenize(sentence)
 
         self.vectorize = vectorize
         self.vector_similarity = vector_similarity
 
+class Lexical_Index:
+
+    loaded = {}
+
+    def __init__(self,postings=None,doc_lengths=None,doc_terms=None,k1=1.5,b=0.75,key=None,deleted=None):
+
+        self.postings = postings if postings is not None else {}
+        self.doc_lengths = doc_lengths if doc_lengths is not None else []
+        self.doc_terms = doc_terms if doc_terms is not None else []
+        self.deleted = set(deleted or [])
+        self.k1 = k1
+        self.b = b
+        self.key = key
+
+    @staticmethod
+    def tokenize(text):
+        """
+        returns lowercased alphanumeric tokens of the text
+        """
+
+        return re.findall(r'[a-z0-9]+',text.lower())
+
+    @staticmethod
+    def build(text_splits,**params):
+        """
+        tokenizes every split once and builds postings lists and document lengths
+        """
+
+        index = Lexical_Index(**params)
+        for split in text_splits:
+            index.add(split)
+        return index
+
+    def add(self,text):
+        """
+        indexes one more document and returns its doc id
+        """
+
+        doc_id = len(self.doc_lengths)
+        tokens = Lexical_Index.tokenize(text)
+        term_counts = {}
+        for token in tokens:
+            term_counts[token] = term_counts.get(token,0) + 1
+        for term, tf in term_counts.items():
+            self.postings.setdefault(term,{})[doc_id] = tf
+        self.doc_lengths.append(len(tokens))
+        self.doc_terms.append(len(term_counts))
+        return doc_id
+
+    def remove(self,doc_id,text):
+        """
+        drops a document from the postings of its terms, its doc id is never reused
+        """
+
+        for term in set(Lexical_Index.tokenize(text)):
+            docs = self.postings.get(term,{})
+            docs.pop(doc_id,None)
+            if not docs:
+                self.postings.pop(term,None)
+        self.doc_lengths[doc_id] = 0
+        self.doc_terms[doc_id] = 0
+        self.deleted.add(doc_id)
+
+    def save(self,path):
+        """
+        writes the index as compact json
+        """
+
+        payload = {'version': 1, 'k1': self.k1, 'b': self.b, 'key': self.key,
+                   'doc_lengths': self.doc_lengths, 'doc_terms': self.doc_terms, 'deleted': sorted(self.deleted),
+                   'postings': {term: [[doc_id,tf] for doc_id, tf in docs.items()] for term, docs in self.postings.items()}}
+        with open(path+'.tmp','w') as f:
+            json.dump(payload,f,separators=(',',':'))
+        os.replace(path+'.tmp',path)
+
+    @staticmethod
+    def load(path):
+        """
+        reads an index written by save, returns None if it does not exist
+        """
+
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            payload = json.load(f)
+        postings = {term: {doc_id: tf for doc_id, tf in docs} for term, docs in payload['postings'].items()}
+        return Lexical_Index(postings,payload['doc_lengths'],payload['doc_terms'],k1=payload['k1'],b=payload['b'],key=payload['key'],deleted=payload.get('deleted'))
+
+    @staticmethod
+    def load_or_build(text_splits,index_dir=INDEX_DIR):
+        """
+        returns the lexical index of the splits, building and saving it on first use
+        """
+
+        key = Embedding_Index.corpus_key(text_splits,index='lexical',tokenizer='alnum-lower')
+        if key in Lexical_Index.loaded:
+            return Lexical_Index.loaded[key]
+        path = os.path.join(index_dir,key+'.lex.json')
+        index = Lexical_Index.load(path)
+        if index is None:
+            index = Lexical_Index.build(text_splits,key=key)
+            os.makedirs(index_dir,exist_ok=True)
+            index.save(path)
+        Lexical_Index.loaded[key] = index
+        return index
+
+    def search(self,query,top_k=3,scoring='bm25'):
+        """
+        returns up to k (split index, score) pairs of the splits that share a query term, fewer when fewer match
+        """
+
+        query_terms = set(Lexical_Index.tokenize(query))
+        n_docs = len(self.doc_lengths) - len(self.deleted)
+        scores = {}
+        if scoring == 'bm25':
+            avg_length = sum(self.doc_lengths)/max(n_docs,1)
+            for term in query_terms:
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1.0 + (n_docs - len(docs) + 0.5)/(len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    norm = self.k1*(1.0 - self.b + self.b*self.doc_lengths[doc_id]/max(avg_length,1e-6))
+                    scores[doc_id] = scores.get(doc_id,0.0) + idf*tf*(self.k1 + 1.0)/(tf + norm)
+        elif scoring == 'jaccard':
+            for term in query_terms:
+                for doc_id in self.postings.get(term,()):
+                    scores[doc_id] = scores.get(doc_id,0) + 1
+            for doc_id, overlap in scores.items():
+                scores[doc_id] = float(overlap)/float(len(query_terms) + self.doc_terms[doc_id] - overlap)
+        else:
+            raise ValueError(f'unknown scoring: {scoring}')
+
+        return heapq.nlargest(top_k,scores.items(),key=lambda item: (item[1],-item[0]))
+
+class Model_Registry:
+
+    models = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def get(model_name='bert-base-uncased',device=None):
+        """
+        returns the shared embedding model for a name and device, loading it on first use
+        """
+
+        key = (model_name,str(device))
+        with Model_Registry.lock:
+            if not key in Model_Registry.models:
+                from flair.embeddings import TransformerDocumentEmbeddings
+                # sentence-transformers checkpoints are trained for mean pooling, raw CLS vectors of them are not comparable
+                cls_pooling = 'mean' if model_name.startswith('sentence-transformers/') else 'cls'
+                embedding_model = TransformerDocumentEmbeddings(model_name,cls_pooling=cls_pooling)
+                if not device is None:
+                    embedding_model.to(device)
+                embedding_model.eval()
+                Model_Registry.models[key] = embedding_model
+            return Model_Registry.models[key]
+
+    @staticmethod
+    def release(model_name=None,device=None):
+        """
+        drops shared models matching the name and device (all models if none given)
+        """
+
+        with Model_Registry.lock:
+            for key in list(Model_Registry.models):
+                if model_name is not None and key[0] != model_name:
+                    continue
+                if device is not None and key[1] != str(device):
+                    continue
+                del Model_Registry.models[key]
+        torch = sys.modules.get('torch')
+        if not torch is None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
 class Neural_Net:
 
-    def __init__(self):
+    def __init__(self,model_name='bert-base-uncased',device=None):
+
+        self.model_name = model_name
+        self.device = device
 
         def vector_similarity(vector1,vector2):
             """
             implements a vector similarity instance
             """
 
+            import torch.nn as nn
             cos = nn.CosineSimilarity(dim=0, eps=1e-6)
             return cos(vector1,vector2)
 
@@ -158,66 +470,821 @@ class Neural_Net:
             implements a vectorizer instance
             """
 
-            embedding_model = TransformerDocumentEmbeddings('bert-base-uncased')
+            import torch
+            from flair.data import Sentence
+            embedding_model = Model_Registry.get(self.model_name,self.device)
             sentence = Sentence(sentence)
-            embedding_model.embed(sentence)
+            with torch.no_grad():
+                embedding_model.embed(sentence)
             return sentence.embedding
 
+        def vectorize_batch(texts,batch_size=32):
+            """
+            implements a batched vectorizer instance, returns an (n_texts, dim) float32 array in input order
+            """
+
+            import torch
+            from flair.data import Sentence
+            embedding_model = Model_Registry.get(self.model_name,self.device)
+            vectors = np.zeros((len(texts),embedding_model.embedding_length),dtype=np.float32)
+            order = sorted([idx for idx in range(len(texts)) if texts[idx].strip()],key=lambda idx: len(texts[idx]))
+            for start in range(0,len(order),batch_size):
+                batch_idxs = order[start:start+batch_size]
+                sentences = [Sentence(texts[idx]) for idx in batch_idxs]
+                with torch.no_grad():
+                    embedding_model.embed(sentences)
+                vectors[batch_idxs] = torch.stack([sentence.embedding for sentence in sentences]).detach().cpu().numpy()
+                for sentence in sentences:
+                    sentence.clear_embeddings()
+            return vectors
+
         self.vectorize = vectorize
+        self.vectorize_batch = vectorize_batch
         self.vector_similarity = vector_similarity
 
+class Similarity_Search:
+
+    def __init__(self,matrix,normalized=False):
+
+        self.matrix = np.asarray(matrix,dtype=np.float32) if normalized else Similarity_Search.normalize(matrix)
+
+    @staticmethod
+    def normalize(vectors):
+        """
+        returns float32 copies of the vectors scaled to unit length along the last axis
+        """
+
+        vectors = np.asarray(vectors,dtype=np.float32)
+        norms = np.linalg.norm(vectors,axis=-1,keepdims=True)
+        return vectors/np.maximum(norms,1e-6)
+
+    @staticmethod
+    def top_k(scores,top_k=3):
+        """
+        returns the indices and scores of the top k entries of each row, ties broken by lower index
+        """
+
+        scores = np.atleast_2d(scores)
+        n_queries, n_items = scores.shape
+        k = min(top_k,n_items)
+        top_idxs = np.zeros((n_queries,k),dtype=np.int64)
+        top_scores = np.zeros((n_queries,k),dtype=scores.dtype)
+        if k == 0:
+            return top_idxs, top_scores
+        kth_scores = -np.partition(-scores,k-1,axis=1)[:,k-1]
+        for row in range(n_queries):
+            candidates = np.flatnonzero(scores[row] >= kth_scores[row])
+            order = np.lexsort((candidates,-scores[row,candidates]))[:k]
+            top_idxs[row] = candidates[order]
+            top_scores[row] = scores[row,top_idxs[row]]
+        return top_idxs, top_scores
+
+    def search(self,query_vectors,top_k=3):
+        """
+        returns unique top k indices and cosine scores for one query vector or a batch of them
+        """
+
+        query_vectors = np.asarray(query_vectors,dtype=np.float32)
+        single_query = query_vectors.ndim == 1
+        scores = Similarity_Search.normalize(np.atleast_2d(query_vectors)) @ self.matrix.T
+        top_idxs, top_scores = Similarity_Search.top_k(scores,top_k=top_k)
+        if single_query:
+            return top_idxs[0], top_scores[0]
+        return top_idxs, top_scores
+
+class Embedding_Index:
+
+    loaded = {}
+
+    def __init__(self,matrix,key=None):
+
+        self.matrix = matrix
+        self.key = key
+        self.engine = Similarity_Search(matrix,normalized=True)
+
+    @staticmethod
+    def corpus_key(text_splits,**settings):
+        """
+        returns a content hash of the text splits and the settings that produced them
+        """
+
+        digest = hashlib.sha256()
+        for name in sorted(settings):
+            digest.update(f'{name}={settings[name]}\n'.encode('utf-8'))
+        if isinstance(text_splits,Corpus_Snapshot):
+            digest.update(f'snapshot={text_splits.name}/{text_splits.version}\n'.encode('utf-8'))
+            return digest.hexdigest()
+        for split in text_splits:
+            digest.update(split.encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    @staticmethod
+    def build(text_splits,neural_net,batch_size=32):
+        """
+        embeds every split once and returns the unit-normalized float32 split matrix
+        """
+
+        return Similarity_Search.normalize(neural_net.vectorize_batch(text_splits,batch_size=batch_size))
+
+    @staticmethod
+    def save(matrix,key,index_dir=INDEX_DIR):
+        """
+        writes the split matrix as raw float32 plus a small json header
+        """
+
+        os.makedirs(index_dir,exist_ok=True)
+        matrix_path = os.path.join(index_dir,key+'.f32')
+        meta_path = os.path.join(index_dir,key+'.json')
+        np.ascontiguousarray(matrix,dtype=np.float32).tofile(matrix_path+'.tmp')
+        os.replace(matrix_path+'.tmp',matrix_path)
+        with open(meta_path+'.tmp','w') as f:
+            json.dump({'key': key, 'n_splits': matrix.shape[0], 'dim': matrix.shape[1], 'dtype': 'float32'},f)
+        os.replace(meta_path+'.tmp',meta_path)
+
+    @staticmethod
+    def load(key,index_dir=INDEX_DIR):
+        """
+        memory-maps a previously saved split matrix, returns None if it does not exist
+        """
+
+        matrix_path = os.path.join(index_dir,key+'.f32')
+        meta_path = os.path.join(index_dir,key+'.json')
+        if not (os.path.exists(matrix_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        shape = (meta['n_splits'],meta['dim'])
+        if os.path.getsize(matrix_path) != shape[0]*shape[1]*np.dtype(np.float32).itemsize:
+            return None
+        if shape[0] == 0:
+            return np.zeros(shape,dtype=np.float32)
+        return np.memmap(matrix_path,dtype=np.float32,mode='r',shape=shape)
+
+    @staticmethod
+    def load_or_build(text_splits,neural_net,index_dir=INDEX_DIR,**settings):
+        """
+        returns the embedding index of the splits, building and saving it on first use
+        """
+
+        settings.setdefault('model',neural_net.model_name)
+        settings.setdefault('layout','unit-norm')
+        key = Embedding_Index.corpus_key(text_splits,**settings)
+        if key in Embedding_Index.loaded:
+            return Embedding_Index.loaded[key]
+        matrix = Embedding_Index.load(key,index_dir=index_dir)
+        if matrix is None:
+            Embedding_Index.save(Embedding_Index.build(text_splits,neural_net),key,index_dir=index_dir)
+            matrix = Embedding_Index.load(key,index_dir=index_dir)
+        index = Embedding_Index(matrix,key=key)
+        Embedding_Index.loaded[key] = index
+        return index
+
+    def search(self,query_vectors,top_k=3):
+        """
+        returns the top k split indices and cosine scores for one query vector or a batch of them
+        """
+
+        return self.engine.search(query_vectors,top_k=top_k)
+
+class Cluster_Index:
+
+    loaded = {}
+
+    def __init__(self,matrix,labels):
+
+        self.engine = Similarity_Search(matrix,normalized=True)
+        self.labels = np.asarray(labels,dtype=np.int64)
+        self.clusters = [np.flatnonzero(self.labels == label) for label in range(int(self.labels.max()) + 1)]
+        self.centroid_engine = Similarity_Search(np.stack([self.engine.matrix[members].mean(axis=0) for members in self.clusters]))
+        self.visited = 0
+        self.queries = 0
+
+    @staticmethod
+    def build(matrix,n_clusters=None):
+        """
+        clusters unit-normalized split vectors into about sqrt(n) clusters and returns the cluster index
+        """
+
+        n_clusters = n_clusters or max(int(math.sqrt(matrix.shape[0])),1)
+        cluster_model = Cluster_Model(n_clusters=n_clusters)
+        cluster_model.cluster(matrix,cut_threshold=-np.inf)
+        return Cluster_Index(matrix,cluster_model.labels)
+
+    @staticmethod
+    def load_or_build(embedding_index,n_clusters=None,index_dir=INDEX_DIR):
+        """
+        returns the cluster index over an embedding index, saving cluster labels next to its matrix
+        """
+
+        key = (embedding_index.key,n_clusters)
+        if key in Cluster_Index.loaded:
+            return Cluster_Index.loaded[key]
+        labels_path = os.path.join(index_dir,f'{embedding_index.key}.ivf{n_clusters or "auto"}.npy')
+        if os.path.exists(labels_path):
+            index = Cluster_Index(embedding_index.matrix,np.load(labels_path))
+        else:
+            index = Cluster_Index.build(embedding_index.matrix,n_clusters=n_clusters)
+            os.makedirs(index_dir,exist_ok=True)
+            np.save(labels_path,index.labels)
+        Cluster_Index.loaded[key] = index
+        return index
+
+    def search(self,query_vectors,top_k=3,n_probe=1):
+        """
+        scores the query against cluster centroids, then only the splits of the n_probe best clusters,
+        returns top k split indices and cosine scores for one query vector or a list for a batch
+        """
+
+        query_vectors = Similarity_Search.normalize(query_vectors)
+        single_query = query_vectors.ndim == 1
+        query_vectors = np.atleast_2d(query_vectors)
+        probed, _ = self.centroid_engine.search(query_vectors,top_k=n_probe)
+        results = []
+        for query_vector, cluster_idxs in zip(query_vectors,probed):
+            candidates = np.concatenate([self.clusters[idx] for idx in cluster_idxs])
+            top_idxs, top_scores = Similarity_Search.top_k(self.engine.matrix[candidates] @ query_vector,top_k=top_k)
+            results.append((candidates[top_idxs[0]],top_scores[0]))
+            self.visited += len(candidates)
+            self.queries += 1
+        if single_query:
+            return results[0]
+        return results
+
+    def recall(self,query_vectors,top_k=3,n_probe=1):
+        """
+        reports recall of the probed search against exhaustive search and the fraction of splits visited
+        """
+
+        query_vectors = np.atleast_2d(query_vectors)
+        exact_idxs, _ = self.engine.search(query_vectors,top_k=top_k)
+        visited, queries = self.visited, self.queries
+        approx = self.search(query_vectors,top_k=top_k,n_probe=n_probe)
+        hits = sum(len(set(exact.tolist()) & set(found.tolist())) for exact, (found, _) in zip(exact_idxs,approx))
+        visited_fraction = (self.visited - visited)/max((self.queries - queries)*self.engine.matrix.shape[0],1)
+        return {'n_probe': n_probe, 'top_k': top_k, 'recall': hits/max(exact_idxs.size,1), 'visited_fraction': visited_fraction}
+
+class Incremental_Index:
+
+    def __init__(self,source_dir,pattern='*.txt',neural_net=None,index_dir=INDEX_DIR,name=None,max_tokens=256,overlap=32,compact_ratio=0.5):
+
+        self.source_dir = source_dir
+        self.pattern = pattern
+        self.neural_net = neural_net
+        self.state_dir = os.path.join(index_dir,'incremental',name or os.path.basename(os.path.normpath(source_dir)))
+        self.settings = {'pattern': pattern, 'max_tokens': max_tokens, 'overlap': overlap, 'chunker': Text_Preprocessor.CHUNKER_VERSION,
+                         'model': None if neural_net is None else neural_net.model_name}
+        self.compact_ratio = compact_ratio
+        self.manifest = {'version': 1, 'settings': self.settings, 'files': {}, 'chunks': {}, 'rows': 0, 'dim': None, 'tombstones': []}
+        self.lexical = Lexical_Index()
+        self.matrix = None
+        self.load()
+
+    def paths(self):
+
+        return {name: os.path.join(self.state_dir,name) for name in ('manifest.json','vectors.f32','lexical.json')}
+
+    def load(self):
+        """
+        restores the manifest, lexical index and vector rows of a previous run if the settings match
+        """
+
+        paths = self.paths()
+        if not os.path.exists(paths['manifest.json']):
+            return
+        with open(paths['manifest.json']) as f:
+            manifest = json.load(f)
+        if manifest.get('settings') != self.settings:
+            return
+        lexical = Lexical_Index.load(paths['lexical.json'])
+        if lexical is None or len(lexical.doc_lengths) != manifest['rows']:
+            return
+        self.manifest, self.lexical = manifest, lexical
+        self.map_vectors()
+
+    def map_vectors(self):
+
+        path, dim, rows = self.paths()['vectors.f32'], self.manifest['dim'], self.manifest['rows']
+        if self.neural_net is None or dim is None or rows == 0:
+            self.matrix = None
+            return
+        row_bytes = dim*np.dtype(np.float32).itemsize
+        if os.path.getsize(path) > rows*row_bytes:
+            with open(path,'r+b') as f:
+                f.truncate(rows*row_bytes)
+        self.matrix = np.memmap(path,dtype=np.float32,mode='r',shape=(rows,dim))
+
+    def save(self):
+
+        paths = self.paths()
+        self.lexical.save(paths['lexical.json'])
+        with open(paths['manifest.json']+'.tmp','w') as f:
+            json.dump(self.manifest,f,separators=(',',':'))
+        os.replace(paths['manifest.json']+'.tmp',paths['manifest.json'])
+
+    @staticmethod
+    def file_digest(path):
+
+        digest = hashlib.sha256()
+        with open(path,'rb') as f:
+            for block in iter(lambda: f.read(1 << 20),b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def update(self):
+        """
+        re-splits, re-embeds and re-indexes only the chunks of added or edited files,
+        tombstones the chunks of edited or deleted files that no longer exist, returns update stats
+        """
+
+        start_time = time.time()
+        os.makedirs(self.state_dir,exist_ok=True)
+        files, chunks = self.manifest['files'], self.manifest['chunks']
+        tombstones = set(self.manifest['tombstones'])
+        stats = {'files_changed': 0, 'files_removed': 0, 'chunks_added': 0, 'chunks_reused': 0, 'chunks_removed': 0}
+
+        current = {os.path.relpath(path,self.source_dir): path for path in sorted(glob.glob(os.path.join(self.source_dir,self.pattern)))}
+        new_chunks = []
+        for name in [name for name in files if not name in current]:
+            for chunk_hash in files.pop(name)['chunks']:
+                tombstones.add(chunks[chunk_hash]['row'])
+                self.lexical.remove(chunks[chunk_hash]['row'],chunks.pop(chunk_hash)['text'])
+                stats['chunks_removed'] += 1
+            stats['files_removed'] += 1
+
+        for name, path in current.items():
+            stat = os.stat(path)
+            entry = files.get(name)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                continue
+            file_hash = Incremental_Index.file_digest(path)
+            if entry and entry['sha256'] == file_hash:
+                entry['mtime'] = stat.st_mtime
+                continue
+            stats['files_changed'] += 1
+            old_hashes = set(entry['chunks']) if entry else set()
+            file_chunks = []
+            for chunk in Text_Preprocessor.stream_chunks(path,max_tokens=self.settings['max_tokens'],overlap=self.settings['overlap']):
+                chunk_hash = hashlib.sha256((name+'\x00'+chunk['text']).encode('utf-8')).hexdigest()
+                if chunk_hash in file_chunks:
+                    continue
+                file_chunks.append(chunk_hash)
+                if chunk_hash in chunks:
+                    chunks[chunk_hash].update(start=chunk['start'],end=chunk['end'])
+                    stats['chunks_reused'] += 1
+                else:
+                    chunks[chunk_hash] = {'row': None, 'file': name, 'start': chunk['start'], 'end': chunk['end'], 'text': chunk['text']}
+                    new_chunks.append(chunk_hash)
+            for chunk_hash in old_hashes - set(file_chunks):
+                tombstones.add(chunks[chunk_hash]['row'])
+                self.lexical.remove(chunks[chunk_hash]['row'],chunks.pop(chunk_hash)['text'])
+                stats['chunks_removed'] += 1
+            files[name] = {'sha256': file_hash, 'size': stat.st_size, 'mtime': stat.st_mtime, 'chunks': file_chunks}
+
+        if new_chunks:
+            texts = [chunks[chunk_hash]['text'] for chunk_hash in new_chunks]
+            if not self.neural_net is None:
+                vectors = Similarity_Search.normalize(self.neural_net.vectorize_batch(texts))
+                self.manifest['dim'] = int(vectors.shape[1])
+                self.matrix = None
+                with open(self.paths()['vectors.f32'],'ab') as f:
+                    f.truncate(self.manifest['rows']*vectors.shape[1]*vectors.itemsize)
+                    vectors.tofile(f)
+            for chunk_hash, text in zip(new_chunks,texts):
+                chunks[chunk_hash]['row'] = self.lexical.add(text)
+            self.manifest['rows'] = len(self.lexical.doc_lengths)
+            stats['chunks_added'] = len(new_chunks)
+
+        self.manifest['tombstones'] = sorted(tombstones)
+        if self.manifest['rows'] and len(tombstones) > self.compact_ratio*self.manifest['rows']:
+            self.compact()
+        else:
+            self.save()
+            self.map_vectors()
+        stats['seconds'] = time.time() - start_time
+        return stats
+
+    def compact(self):
+        """
+        rewrites the vector rows and lexical index without tombstoned rows
+        """
+
+        live = sorted(self.manifest['chunks'].values(),key=lambda chunk: chunk['row'])
+        paths = self.paths()
+        self.map_vectors()
+        if not self.matrix is None:
+            np.ascontiguousarray(self.matrix[[chunk['row'] for chunk in live]]).tofile(paths['vectors.f32']+'.tmp')
+            self.matrix = None
+            os.replace(paths['vectors.f32']+'.tmp',paths['vectors.f32'])
+        self.lexical = Lexical_Index()
+        for chunk in live:
+            chunk['row'] = self.lexical.add(chunk['text'])
+        self.manifest['rows'] = len(live)
+        self.manifest['tombstones'] = []
+        self.save()
+        self.map_vectors()
+
+    @property
+    def texts(self):
+        """
+        returns the chunk text of every row, empty for tombstoned rows
+        """
+
+        texts = ['']*self.manifest['rows']
+        for chunk in self.manifest['chunks'].values():
+            texts[chunk['row']] = chunk['text']
+        return texts
+
+    def search(self,query_vectors,top_k=3):
+        """
+        returns the top k live rows and cosine scores for one query vector or a batch of them
+        """
+
+        query_vectors = np.asarray(query_vectors,dtype=np.float32)
+        single_query = query_vectors.ndim == 1
+        scores = Similarity_Search.normalize(np.atleast_2d(query_vectors)) @ self.matrix.T
+        scores[:,self.manifest['tombstones']] = -np.inf
+        top_idxs, top_scores = Similarity_Search.top_k(scores,top_k=min(top_k,self.manifest['rows'] - len(self.manifest['tombstones'])))
+        if single_query:
+            return top_idxs[0], top_scores[0]
+        return top_idxs, top_scores
+
+class Corpus_Snapshot:
+
+    FORMAT = 1
+    CHUNK_DTYPE = np.dtype([('text_start',np.int64),('text_end',np.int64),('source',np.int32),('section',np.int32),
+                            ('start',np.int64),('end',np.int64),('n_tokens',np.int32)])
+    loaded = {}
+
+    def __init__(self,name,version,manifest,chunks,text):
+
+        self.name = name
+        self.version = version
+        self.manifest = manifest
+        self.chunks = chunks
+        self.text = text
+
+    def __len__(self):
+
+        return self.chunks.shape[0]
+
+    def __getitem__(self,idx):
+
+        if isinstance(idx,slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        row = self.chunks[idx]
+        return self.text[row['text_start']:row['text_end']].tobytes().decode('utf-8')
+
+    def __iter__(self):
+
+        for idx in range(len(self)):
+            yield self[idx]
+
+    @staticmethod
+    def source_record(path):
+
+        stat = os.stat(path)
+        return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': Incremental_Index.file_digest(path)}
+
+    @staticmethod
+    def build(name,paths,snapshot_dir=SNAPSHOT_DIR,max_tokens=256,overlap=32):
+        """
+        normalizes and chunks the source files once and writes a versioned snapshot of the cleaned chunk text,
+        the chunk table and the source offsets, then points the name at it
+        """
+
+        sources = [Corpus_Snapshot.source_record(path) for path in paths]
+        settings = {'format': Corpus_Snapshot.FORMAT, 'chunker': Text_Preprocessor.CHUNKER_VERSION, 'max_tokens': max_tokens, 'overlap': overlap}
+        version = Embedding_Index.corpus_key([source['sha256'] for source in sources],**settings)[:16]
+        version_dir = os.path.join(snapshot_dir,name,version)
+
+        manifest_path = os.path.join(version_dir,'manifest.json')
+        if os.path.exists(manifest_path):
+            # same content under a new stat (e.g. a fresh checkout), only the recorded sources change
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            manifest['sources'] = sources
+        else:
+            os.makedirs(version_dir,exist_ok=True)
+            rows, text_end = [], 0
+            with open(os.path.join(version_dir,'text.bin.tmp'),'wb') as text_file:
+                for source_id, path in enumerate(paths):
+                    for chunk in Text_Preprocessor.stream_chunks(path,max_tokens=max_tokens,overlap=overlap):
+                        encoded = chunk['text'].encode('utf-8')
+                        text_file.write(encoded)
+                        rows.append((text_end,text_end + len(encoded),source_id,chunk['section'],chunk['start'],chunk['end'],chunk['n_tokens']))
+                        text_end += len(encoded)
+            np.save(os.path.join(version_dir,'chunks.tmp.npy'),np.array(rows,dtype=Corpus_Snapshot.CHUNK_DTYPE))
+            os.replace(os.path.join(version_dir,'text.bin.tmp'),os.path.join(version_dir,'text.bin'))
+            os.replace(os.path.join(version_dir,'chunks.tmp.npy'),os.path.join(version_dir,'chunks.npy'))
+            manifest = {'name': name, 'version': version, 'settings': settings, 'sources': sources, 'n_chunks': len(rows), 'text_bytes': text_end}
+        with open(manifest_path+'.tmp','w') as f:
+            json.dump(manifest,f,indent=1)
+        os.replace(manifest_path+'.tmp',manifest_path)
+
+        current_path = os.path.join(snapshot_dir,name,'CURRENT')
+        with open(current_path+'.tmp','w') as f:
+            f.write(version)
+        os.replace(current_path+'.tmp',current_path)
+        Corpus_Snapshot.loaded.pop(name,None)
+        return version
+
+    @staticmethod
+    def load(name,snapshot_dir=SNAPSHOT_DIR):
+        """
+        memory-maps the current snapshot of a name, returns None if none was built
+        """
+
+        current_path = os.path.join(snapshot_dir,name,'CURRENT')
+        if not os.path.exists(current_path):
+            return None
+        with open(current_path) as f:
+            version = f.read().strip()
+        version_dir = os.path.join(snapshot_dir,name,version)
+        manifest_path = os.path.join(version_dir,'manifest.json')
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        chunks = np.load(os.path.join(version_dir,'chunks.npy'),mmap_mode='r')
+        text_path = os.path.join(version_dir,'text.bin')
+        if chunks.shape[0] != manifest['n_chunks'] or os.path.getsize(text_path) != manifest['text_bytes']:
+            return None
+        text = np.memmap(text_path,dtype=np.uint8,mode='r') if manifest['text_bytes'] else np.zeros(0,dtype=np.uint8)
+        return Corpus_Snapshot(name,version,manifest,chunks,text)
+
+    def is_stale(self,paths=None):
+        """
+        checks the snapshot sources against the files on disk by size and mtime,
+        hashing only files whose stat changed
+        """
+
+        recorded = self.manifest['sources']
+        if not paths is None and [os.path.abspath(path) for path in paths] != [source['path'] for source in recorded]:
+            return True
+        for source in recorded:
+            if not os.path.exists(source['path']):
+                return True
+            stat = os.stat(source['path'])
+            if (stat.st_size, stat.st_mtime_ns) == (source['size'], source['mtime_ns']):
+                continue
+            if stat.st_size != source['size'] or Incremental_Index.file_digest(source['path']) != source['sha256']:
+                return True
+        return False
+
+    @staticmethod
+    def load_or_build(name,paths,snapshot_dir=SNAPSHOT_DIR,max_tokens=256,overlap=32):
+        """
+        returns the current snapshot of a name, rebuilding it only if it is missing, stale or was built with other settings
+        """
+
+        snapshot = Corpus_Snapshot.loaded.get(name)
+        if snapshot is None:
+            snapshot = Corpus_Snapshot.load(name,snapshot_dir=snapshot_dir)
+        settings = {'format': Corpus_Snapshot.FORMAT, 'chunker': Text_Preprocessor.CHUNKER_VERSION, 'max_tokens': max_tokens, 'overlap': overlap}
+        if snapshot is None or snapshot.manifest['settings'] != settings or snapshot.is_stale(paths):
+            Corpus_Snapshot.build(name,paths,snapshot_dir=snapshot_dir,max_tokens=max_tokens,overlap=overlap)
+            snapshot = Corpus_Snapshot.load(name,snapshot_dir=snapshot_dir)
+        Corpus_Snapshot.loaded[name] = snapshot
+        return snapshot
+
+    def source_span(self,idx):
+        """
+        returns the source path and byte span a chunk was cut from
+        """
+
+        row = self.chunks[idx]
+        return self.manifest['sources'][int(row['source'])]['path'], int(row['start']), int(row['end'])
+
+class Semantic_Cache:
+
+    def __init__(self,neural_net=None,threshold=None,max_entries_per_role=256):
+
+        self.neural_net = neural_net or Neural_Net(SENTENCE_MODEL)
+        self.configured_threshold = CACHE_THRESHOLD if threshold is None else threshold
+        self.threshold = self.configured_threshold
+        self.max_entries_per_role = max_entries_per_role
+        self.roles = {}
+        self.tick = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def embed(self,query):
+        """
+        returns the normalized query vector, callers pass it on to lookup and store to embed a query once
+        """
+
+        return Similarity_Search.normalize(self.neural_net.vectorize_batch([query])[0])
+
+    def lookup(self,role,query,query_vector=None):
+        """
+        returns the stored entry of the most similar past query of the same role when it clears
+        the similarity threshold, otherwise None
+        """
+
+        query_vector = self.embed(query) if query_vector is None else query_vector
+        with self.lock:
+            scope = self.roles.get(role)
+            if scope is None or not scope['entries']:
+                self.misses += 1
+                return None
+            similarities = scope['vectors'][:len(scope['entries'])] @ query_vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.tick += 1
+            entry = scope['entries'][best]
+            entry['last_used'] = self.tick
+            self.hits += 1
+            return dict(entry,similarity=float(similarities[best]))
+
+    def store(self,role,query,answer,context=None,query_vector=None):
+        """
+        remembers the answer and retrieved context of a (role, query) pair, evicting the least recently used entry of a full role
+        """
+
+        query_vector = self.embed(query) if query_vector is None else query_vector
+        with self.lock:
+            self.tick += 1
+            entry = {'query': query, 'answer': answer, 'context': context, 'last_used': self.tick}
+            scope = self.roles.setdefault(role,{'vectors': np.zeros((self.max_entries_per_role,query_vector.shape[0]),dtype=np.float32),'entries': []})
+            if len(scope['entries']) < self.max_entries_per_role:
+                row = len(scope['entries'])
+                scope['entries'].append(entry)
+            else:
+                row = min(range(len(scope['entries'])),key=lambda idx: scope['entries'][idx]['last_used'])
+                scope['entries'][row] = entry
+            scope['vectors'][row] = query_vector
+
+    def pair_similarities(self,pairs):
+
+        if not pairs:
+            return np.zeros(0,dtype=np.float32)
+        vectors = Similarity_Search.normalize(self.neural_net.vectorize_batch([query for pair in pairs for query in pair]))
+        return np.sum(vectors[0::2]*vectors[1::2],axis=-1)
+
+    def calibrate(self,paraphrase_pairs,distinct_pairs,margin=0.02):
+        """
+        raises the threshold above the configured one when a pair labelled as different questions would clear it,
+        never lowers it below the configured one, returns the calibration stats
+        """
+
+        paraphrase_similarities = self.pair_similarities(paraphrase_pairs)
+        distinct_similarities = self.pair_similarities(distinct_pairs)
+        max_distinct = float(distinct_similarities.max()) if len(distinct_pairs) else None
+
+        self.threshold = self.configured_threshold if max_distinct is None else min(max(self.configured_threshold,max_distinct + margin),1.0)
+        return {'threshold': self.threshold, 'configured_threshold': self.configured_threshold, 'max_distinct_similarity': max_distinct,
+                'min_paraphrase_similarity': float(paraphrase_similarities.min()) if len(paraphrase_pairs) else None,
+                'paraphrase_recall': float(np.mean(paraphrase_similarities >= self.threshold)) if len(paraphrase_pairs) else None}
+
+    def stats(self):
+
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'threshold': self.threshold,
+                    'entries': {role: len(scope['entries']) for role, scope in self.roles.items()}}
+
 class Retr:
 
     @staticmethod
-    def retrieve_context_neural(text_splits,random_question,neural_net,top_k = 3):
+    def search_neural(text_splits,query,neural_net,top_k = 3,index = None,n_probe = None):
+        """
+        returns top k (split index, cosine score) pairs based on vector similarity search,
+        probing only the n_probe closest clusters when n_probe is set
+        """
+
+        if index is None:
+            index = Embedding_Index.load_or_build(text_splits,neural_net)
+        if not n_probe is None and not isinstance(index,Cluster_Index):
+            index = Cluster_Index.load_or_build(index)
+        query_vector = neural_net.vectorize_batch([query])[0]
+        if isinstance(index,Cluster_Index):
+            top_idxs, top_scores = index.search(query_vector,top_k=top_k,n_probe=n_probe or 1)
+            return list(zip(top_idxs.tolist(),top_scores.tolist()))
+        top_idxs, top_scores = index.search(query_vector,top_k=top_k)
+        return list(zip(top_idxs.tolist(),top_scores.tolist()))
+
+    @staticmethod
+    def search_symbolic(text_splits,query,symb_model,top_k = 3,index = None):
+        """
+        returns top k (split index, lexical score) pairs based on symbolic search
+        """
+
+        if index is None:
+            index = Lexical_Index.load_or_build(text_splits)
+        return index.search(query,top_k=top_k,scoring=symb_model.scoring)
+
+    @staticmethod
+    def retrieve_context_neural(text_splits,random_question,neural_net,top_k = 3,index = None,n_probe = None):
         """
         retrieves top k context based on vector similarity search
         """
 
-        query_vector = neural_net.vectorize(random_question); query_vectors = [query_vector for _ in range(len(text_splits))]
-        split_vectors = [neural_net.vectorize(split) for split in text_splits]
-        similarities = [neural_net.vector_similarity(x[0],x[1]).item() for x in zip(query_vectors,split_vectors)]
-        top_3_idxs = [similarities.index(y) for y in sorted(similarities)[::-1][:top_k]]
-        return [text_splits[idx] for idx in top_3_idxs]
+        return [text_splits[idx] for idx, _ in Retr.search_neural(text_splits,random_question,neural_net,top_k=top_k,index=index,n_probe=n_probe)]
 
-    def retrieve_context_symbolic(text_splits,random_question,symb_model,top_k = 3):
+    @staticmethod
+    def retrieve_context_symbolic(text_splits,random_question,symb_model,top_k = 3,index = None):
         """
         retrieves top k context based on symbolic search
         """
-        n = len(text_splits)
-        query_vector = symb_model.vectorize(random_question); query_vectors = [query_vector for _ in range(n)]
-        split_vectors = [symb_model.vectorize(split) for split in text_splits]
-        similarities = [symb_model.vector_similarity(x[0],x[1]) for x in zip(query_vectors,split_vectors)]
-        top_idxs = [similarities.index(y) for y in sorted(similarities)[::-1][:top_k]]
-        return [text_splits[idx] for idx in top_idxs]
 
-    def retrieve_context(text_splits,query,neural_net=None,symb_model=None,top_k = 3):
+        return [text_splits[idx] for idx, _ in Retr.search_symbolic(text_splits,random_question,symb_model,top_k=top_k,index=index)]
+
+    @staticmethod
+    def fuse(ranked_lists,top_k = 3,fusion = 'rrf',weights = None,rrf_k = 60):
+        """
+        merges ranked (split index, score) lists into one deduplicated top k list,
+        using reciprocal rank fusion ('rrf') or min-max normalized weighted scores ('weighted'),
+        zero-score entries matched nothing and are left out
+        """
+
+        weights = weights or {}
+        fused, attribution = {}, {}
+        for name, ranked in ranked_lists.items():
+            weight = weights.get(name,1.0)
+            ranked = [(idx, score) for idx, score in ranked if score != 0]
+            if fusion == 'weighted' and ranked:
+                low, high = min(score for _, score in ranked), max(score for _, score in ranked)
+            for rank, (idx, score) in enumerate(ranked):
+                if fusion == 'rrf':
+                    contribution = weight/(rrf_k + rank + 1)
+                elif fusion == 'weighted':
+                    contribution = weight*((score - low)/(high - low) if high > low else float(high > 0))
+                else:
+                    raise ValueError(f'unknown fusion: {fusion}')
+                fused[idx] = fused.get(idx,0.0) + contribution
+                attribution.setdefault(idx,{})[name] = {'rank': rank + 1, 'score': score}
+
+        top = heapq.nlargest(top_k,fused.items(),key=lambda item: (item[1],-item[0]))
+        return [{'split_idx': idx, 'score': score, 'retrievers': attribution[idx]} for idx, score in top]
+
+    @staticmethod
+    def retrieve_context(text_splits,query,neural_net=None,symb_model=None,top_k = 3,fusion = 'rrf',weights = None,depth = None,n_probe = None,return_scores = False,neural_index = None,symbolic_index = None):
         """
-        retrieves top k context based on hybrid search
+        retrieves top k context based on hybrid search, running the retrievers concurrently and fusing their rankings
         """
-        neural_context, symbolic_context = [], []
+
+        depth = depth or max(2*top_k,10)
+        searches = {}
         if not neural_net is None:
-            neural_context += Retr.retrieve_context_neural(text_splits,query,neural_net,top_k=top_k)
+            searches['neural'] = lambda: Retr.search_neural(text_splits,query,neural_net,top_k=depth,index=neural_index,n_probe=n_probe)
         if not symb_model is None:
-            symbolic_context += Retr.retrieve_context_symbolic(text_splits,query,symb_model,top_k=top_k)
-        return neural_context + symbolic_context
+            searches['symbolic'] = lambda: Retr.search_symbolic(text_splits,query,symb_model,top_k=depth,index=symbolic_index)
+
+        if len(searches) > 1:
+            with ThreadPoolExecutor(max_workers=len(searches)) as executor:
+                futures = {name: executor.submit(search) for name, search in searches.items()}
+                ranked_lists = {name: future.result() for name, future in futures.items()}
+        else:
+            ranked_lists = {name: search() for name, search in searches.items()}
+
+        results = Retr.fuse(ranked_lists,top_k=top_k,fusion=fusion,weights=weights)
+        for result in results:
+            result['split'] = text_splits[result['split_idx']]
+        if return_scores:
+            return results
+        return [result['split'] for result in results]
 
 class Knowledge_Representation:
 
     @staticmethod
-    def organize_data(article_text):
+    def organize_data(article_text,use_clusters=False,n_clusters=None):
         
-        cluster_obj = Cluster_Model() #levels default = 4
         text_splits = Text_Preprocessor.text_splitter(article_text,split_size=100)
-        '''
-        print (max([len(item) for item in text_splits])); input()
-        text_split_vectors = [Neural_Net().vectorize(split) for split in tqdm(text_splits)]
-        clusters = cluster_obj.cluster(text_split_vectors)
-        text_clusters = []
-        for cluster in clusters:
-            idxs = [int(item) for item in cluster.split(';')[:-1]]
-            text_cluster = ''.join([text_splits[idx] for idx in idxs])
-            text_clusters.append(text_cluster)
-        '''
         text_clusters = text_splits
-        return text_clusters
\ No newline at end of file
+        if use_clusters:
+            # raw CLS vectors are all positively correlated, so a similarity cut would merge everything,
+            # stop at about sqrt(n) clusters instead, like Cluster_Index.build
+            cluster_obj = Cluster_Model(n_clusters=n_clusters or max(int(math.sqrt(len(text_splits))),1))
+            text_split_vectors = Neural_Net().vectorize_batch(text_splits)
+            clusters = cluster_obj.cluster(text_split_vectors,cut_threshold=-np.inf)
+            text_clusters = [''.join([text_splits[idx] for idx in cluster]) for cluster in clusters]
+        return text_clusters
+
+    @staticmethod
+    def organize_chunks(path,max_tokens=256,overlap=32):
+        """
+        returns the text of the structure-aware chunks streamed from a file
+        """
+
+        return [chunk['text'] for chunk in Text_Preprocessor.stream_chunks(path,max_tokens=max_tokens,overlap=overlap)]
+
+    @staticmethod
+    def organize_snapshot(name,paths,max_tokens=256,overlap=32):
+        """
+        returns the memory-mapped chunk snapshot of the source files, chunking them only when they changed
+        """
+
+        return Corpus_Snapshot.load_or_build(name,paths,max_tokens=max_tokens,overlap=overlap)
+
+    @staticmethod
+    def organize_incremental(source_dir,neural_net=None,max_tokens=256,overlap=32):
+        """
+        brings the incremental index of a directory of source shards up to date and returns it
+        """
+
+        index = Incremental_Index(source_dir,neural_net=neural_net,max_tokens=max_tokens,overlap=overlap)
+        index.update()
+        return index
\ No newline at end of file
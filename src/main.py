@@ -2,7 +2,7 @@ import os
 from random import choice
 from assets.DataUtils import AssetLoader
 from copilots.Memory_Utils import Knowledge_Representation, Retr, Symbolic_Model
-from copilots.Agents import LLM
+from copilots.Agents import LLM, Json_Stream_Extractor, Rolling_Summarizer
 
 class MTSS_Copilot:
 
@@ -18,47 +18,99 @@ class MTSS_Copilot:
         return random_user_role, random_user_query
 
     @staticmethod
-    def simulate_QA_agent_turn(user_role, user_query, data):
+    def simulate_QA_agent_turn(user_role, user_query, data, on_token=None, semantic_cache=None):
 
         llm_response = None
-        context = Retr.retrieve_context(data,user_query,symb_model=Symbolic_Model(),top_k=1)[0]
         system_template = AssetLoader.get_templates()[user_role]
+        query_vector = None if semantic_cache is None else semantic_cache.embed(user_query)
+        cached = None if semantic_cache is None else semantic_cache.lookup(user_role, user_query, query_vector)
+        if not cached is None:
+            if not on_token is None:
+                on_token(cached['answer'])
+            return system_template, cached['answer']
+
+        context = Retr.retrieve_context(data,user_query,symb_model=Symbolic_Model(),top_k=3,return_scores=True)
         llm = LLM()
         llm.set_prompt(system_template,user_query,context)
-        llm_response = llm.respond_to_prompt()
+        if on_token is None:
+            llm_response = Json_Stream_Extractor.extract(llm.respond_to_prompt(),'Response')
+        else:
+            llm_response = ''.join([on_token(piece) or piece for piece in llm.stream_response(extract_key='Response')])
+        if not semantic_cache is None:
+            semantic_cache.store(user_role, user_query, llm_response, context, query_vector)
         return system_template, llm_response
 
     @staticmethod
-    def simulate_summary_agent(total_information):
+    def simulate_QA_agent_turns(user_turns, data, max_concurrency=4, semantic_cache=None):
+
+        llm = LLM()
+        system_templates, llm_responses, contexts, query_vectors, prompts, pending = [], [], [], [], [], []
+        for turn, (user_role, user_query) in enumerate(user_turns):
+            system_template = AssetLoader.get_templates()[user_role]
+            system_templates.append(system_template)
+            query_vectors.append(None if semantic_cache is None else semantic_cache.embed(user_query))
+            cached = None if semantic_cache is None else semantic_cache.lookup(user_role, user_query, query_vectors[turn])
+            if not cached is None:
+                llm_responses.append(cached['answer'])
+                contexts.append(cached['context'])
+                continue
+            context = Retr.retrieve_context(data,user_query,symb_model=Symbolic_Model(),top_k=3,return_scores=True)
+            llm_responses.append(None)
+            contexts.append(context)
+            prompts.append(llm.set_prompt(system_template,user_query,context))
+            pending.append(turn)
+        for turn, llm_response in zip(pending, llm.respond_many(prompts,max_concurrency=max_concurrency) if prompts else []):
+            if not isinstance(llm_response, Exception):
+                llm_response = Json_Stream_Extractor.extract(llm_response,'Response')
+            llm_responses[turn] = llm_response
+            if not semantic_cache is None and not isinstance(llm_response, Exception):
+                semantic_cache.store(*user_turns[turn], llm_response, contexts[turn], query_vectors[turn])
+        return list(zip(system_templates,llm_responses))
+
+    @staticmethod
+    def simulate_summary_agent(total_information, on_token=None):
 
         llm_response = None
         llm = LLM()
         llm.set_prompt(summary_content=total_information)
-        llm_response = llm.respond_to_prompt()
+        if on_token is None:
+            llm_response = Json_Stream_Extractor.extract(llm.respond_to_prompt(),'Summary')
+        else:
+            llm_response = ''.join([on_token(piece) or piece for piece in llm.stream_response(extract_key='Summary')])
         return llm_response
 
     @staticmethod
-    def run_demo(turns = 2):
+    def run_demo(turns = 2, stream = False, semantic_cache = None):
         
-        mtss_text_data = AssetLoader.read_data()
-        mtss_data_repr = Knowledge_Representation.organize_data(mtss_text_data)
+        mtss_data_repr = Knowledge_Representation.organize_snapshot('course',[AssetLoader.course_file()])
 
-        total_information = ""
+        summarizer = Rolling_Summarizer()
+        print_token = lambda piece: print (piece, end='', flush=True)
 
-        for _ in range(turns):
-            user_role, user_query = MTSS_Copilot.simulate_user_turn()
+        user_turns = [MTSS_Copilot.simulate_user_turn() for _ in range(turns)]
+        if not stream:
+            agent_turns = MTSS_Copilot.simulate_QA_agent_turns(user_turns, mtss_data_repr, semantic_cache=semantic_cache)
+
+        for turn, (user_role, user_query) in enumerate(user_turns):
 
             print ('\n ===== USER attributes =====\n')
             print ('user role:', user_role)
             print ('user_query', user_query)
-            
-            agent_instructions, agent_response = MTSS_Copilot.simulate_QA_agent_turn(user_role, user_query, mtss_data_repr)
-            total_information += str(agent_response)
-            print ('\n ===== SYSTEM INSTRUCTIONS ===== \n',agent_instructions)
-            print ('\n ===== SYSTEM RESPONSE ===== \n',agent_response)
-
-        summary_agent_response = MTSS_Copilot.simulate_summary_agent(total_information)
-        print ('\n ===== INFORMATION SUMMARY ===== \n',summary_agent_response)
+
+            if stream:
+                print ('\n ===== SYSTEM INSTRUCTIONS ===== \n',AssetLoader.get_templates()[user_role])
+                print ('\n ===== SYSTEM RESPONSE ===== \n')
+                agent_instructions, agent_response = MTSS_Copilot.simulate_QA_agent_turn(user_role, user_query, mtss_data_repr, on_token=print_token, semantic_cache=semantic_cache)
+                print ()
+            else:
+                agent_instructions, agent_response = agent_turns[turn]
+                print ('\n ===== SYSTEM INSTRUCTIONS ===== \n',agent_instructions)
+                print ('\n ===== SYSTEM RESPONSE ===== \n',agent_response)
+
+            if not isinstance(agent_response, Exception):
+                summarizer.fold(agent_response)
+
+        print ('\n ===== INFORMATION SUMMARY ===== \n',summarizer.summary)
 
 if __name__ == '__main__':
     MTSS_Copilot.run_demo()
\ No newline at end of file
@@ -0,0 +1,127 @@
+import json
+import signal
+import threading
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from assets.DataUtils import AssetLoader
+from copilots.Memory_Utils import Knowledge_Representation, Lexical_Index, Semantic_Cache
+from copilots.Agents import Client_Pool, LLM_Error, LLM_Retryable_Error
+from main import MTSS_Copilot
+
+class Copilot_Service:
+
+    def __init__(self, use_semantic_cache=False, max_concurrency=8):
+
+        self.use_semantic_cache = use_semantic_cache
+        self.semantic_cache = None
+        self.data = None
+        self.error = None
+        self.ready = threading.Event()
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+
+    def warm_up(self):
+        """
+        loads the corpus, indexes and models once so requests only pay for the query
+        """
+
+        try:
+            self.data = Knowledge_Representation.organize_snapshot('course',[AssetLoader.course_file()])
+            Lexical_Index.load_or_build(self.data)
+            if self.use_semantic_cache:
+                self.semantic_cache = Semantic_Cache()
+                print (f'semantic cache calibrated: {self.semantic_cache.calibrate(AssetLoader.get_paraphrases(),AssetLoader.get_distinct_pairs())}')
+            self.ready.set()
+        except Exception as e:
+            self.error = e
+            raise
+
+    def answer(self, user_role, user_query):
+        """
+        answers one (role, query) request with the warm representation
+        """
+
+        if not user_role in AssetLoader.get_templates():
+            raise ValueError(f'unknown role: {user_role}')
+        with self.slots:
+            _, agent_response = MTSS_Copilot.simulate_QA_agent_turn(user_role, user_query, self.data, semantic_cache=self.semantic_cache)
+        return agent_response
+
+class Copilot_Handler(BaseHTTPRequestHandler):
+
+    service = None
+
+    def send_json(self, status, payload):
+
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+
+        if self.path == '/healthz':
+            self.send_json(200, {'status': 'ok'})
+        elif self.path == '/readyz':
+            if self.service.ready.is_set():
+                self.send_json(200, {'status': 'ready'})
+            else:
+                self.send_json(503, {'status': 'failed' if self.service.error else 'warming up', 'error': str(self.service.error or '')})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+
+        if self.path != '/answer':
+            self.send_json(404, {'error': 'not found'})
+            return
+        if not self.service.ready.is_set():
+            self.send_json(503, {'error': 'service is not ready'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            user_role, user_query = request['role'], request['query']
+            agent_response = self.service.answer(user_role, user_query)
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+        except LLM_Retryable_Error as e:
+            self.send_json(503, {'error': str(e)})
+        except LLM_Error as e:
+            self.send_json(502, {'error': str(e)})
+        else:
+            self.send_json(200, {'role': user_role, 'query': user_query, 'response': agent_response})
+
+def serve(host='127.0.0.1', port=8080, use_semantic_cache=False, max_concurrency=8):
+    """
+    runs the copilot http service until SIGINT or SIGTERM, finishing in-flight requests before exiting
+    """
+
+    service = Copilot_Service(use_semantic_cache=use_semantic_cache, max_concurrency=max_concurrency)
+    Copilot_Handler.service = service
+    server = ThreadingHTTPServer((host, port), Copilot_Handler)
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    threading.Thread(target=service.warm_up, daemon=True).start()
+
+    print (f'serving MTSS copilot on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        Client_Pool.shutdown()
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='long-running MTSS copilot service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--semantic-cache', action='store_true')
+    parser.add_argument('--max-concurrency', type=int, default=8)
+    args = parser.parse_args()
+    serve(args.host, args.port, use_semantic_cache=args.semantic_cache, max_concurrency=args.max_concurrency)